@@ -6,5 +6,5 @@ git fetch
 if [[ `git log HEAD..origin/master --oneline` ]]; then
   git pull origin master
   popd
-  python manage.py load_agency_contacts ${FOIA_DIR}/contacts/data
+  python manage.py load_agency_contacts --incremental ${FOIA_DIR}/contacts/data
 fi
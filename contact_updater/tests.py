@@ -45,6 +45,8 @@ class MainPageTests(TestCase):
         response = self.client.get(reverse('contact_updater_index'))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Update your')
+        # The agency search is fed every agency, not a page of them
+        self.assertContains(response, "var typeaheadUrl = '/api/typeahead/")
 
 
 class FormPageTests(TestCase):
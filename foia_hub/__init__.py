@@ -0,0 +1 @@
+default_app_config = 'foia_hub.apps.FoiaHubConfig'
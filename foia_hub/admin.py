@@ -1,9 +1,35 @@
 from django.contrib import admin
+from foia_hub.api import refresh_documents
+from foia_hub.caching import bump_generation
 from foia_hub.models import Office, Agency
+from foia_hub.signals import refreshing_later
 
 
 class GenericAdmin(admin.ModelAdmin):
-    pass
+
+    def changed(self, obj):
+        """ Regenerates the detail documents that the changed agency or
+        office appears in, and bumps the data generation, announcing the
+        change. """
+
+        if isinstance(obj, Agency):
+            refresh_documents([obj.slug])
+            bump_generation(agencies=[obj.slug], offices=[])
+        else:
+            refresh_documents([obj.agency.slug])
+            bump_generation(agencies=[obj.agency.slug], offices=[obj.slug])
+
+    # Deleting cascades to offices, stats and reading rooms, so documents
+    # are refreshed once, when everything is written
+    def save_model(self, request, obj, form, change):
+        with refreshing_later():
+            super(GenericAdmin, self).save_model(request, obj, form, change)
+        self.changed(obj)
+
+    def delete_model(self, request, obj):
+        with refreshing_later():
+            super(GenericAdmin, self).delete_model(request, obj)
+        self.changed(obj)
 
 
 admin.site.register(Office, GenericAdmin)
@@ -1,39 +1,34 @@
 import datetime
 
 from django.db import transaction
+from django.conf import settings
 from django.conf.urls import patterns, url
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.utils.html import escape
+from django.db.models import Q, Prefetch
 
 from restless.dj import DjangoResource
 from restless.resources import skip_prepare
 from restless.preparers import FieldsPreparer
 from restless.exceptions import BadRequest
 
-from foia_hub.models import Agency, Office, Requester, FOIARequest
+from foia_hub import replica, search as search_index
+from foia_hub.caching import cache_key, cached, cached_search
+from foia_hub.search import START_SEL, STOP_SEL
+from foia_hub.snapshot import get_snapshot
+from foia_hub.models import Agency, Office, Requester, FOIARequest, Stats
 
 from django.db import connection
+from django.db.backends.utils import CursorWrapper
 
+import base64
+import hashlib
+import os
 import re
 import string
-from json import loads
-
-
-def dictfetchall(cursor):
-    """
-    Returns all rows from a cursor as a dict this function appears in the
-    django documentation
-    """
-    desc = cursor.description
-    data = []
-    for row in cursor.fetchall():
-        agency = dict(zip([col[0] for col in desc], row))
-        keywords = agency.get('keywords')
-        # change keywords back to list
-        if keywords:
-            agency['keywords'] = loads(keywords)
-        data.append(agency)
-    return data
+import uuid
+from collections import Counter, defaultdict
+from json import dumps, loads
 
 
 # Compile regex patterns
@@ -71,6 +66,220 @@ def sanitize_search_term(term):
     return term
 
 
+def normalize_query(q):
+    """ The form of the search `q` that its results are cached under, so
+    that searches differing only in case, punctuation or spacing share them.
+    None if there is no search. """
+
+    if not q:
+        return None
+    return sanitize_search_term(q).lower()
+
+
+def search_text(q):
+    """ The search `q` as it's run and shown: its normalized form, as plain
+    words, with OR between alternatives. Every search is run on this text,
+    so that searches sharing cached results also find the same things. None
+    if there is no search, and '' if there is nothing in it to search for
+    (such as `!`), which finds nothing. """
+
+    normalized = normalize_query(q)
+    if not normalized:
+        return normalized
+    return normalized.replace(':*', '').replace(' & ', ' ').replace(
+        ' | ', ' OR ')
+
+
+tsquery_token_re = re.compile(r'[&|]|[^\s&|]+')
+tsquery_operand_re = re.compile(r'^[\w-]*\w[\w-]*:\*$')
+word_re = re.compile(r'\w')
+
+
+def is_valid_tsquery(term):
+    """
+    Whether a sanitized search term is something to_tsquery can parse: words
+    joined by single `&` or `|` operators. Anything else (such as a dangling
+    operator) is searched for fuzzily, rather than sent to Postgres to fail.
+    """
+    tokens = tsquery_token_re.findall(term)
+    if len(tokens) % 2 == 0:
+        return False
+    for i, token in enumerate(tokens):
+        if i % 2:
+            if token not in ('&', '|'):
+                return False
+        elif not tsquery_operand_re.match(token):
+            return False
+    return True
+
+
+# Only the agency columns that the list preparer and the agencies page use,
+# so that search vectors and detail documents aren't fetched
+AGENCY_SEARCH_COLUMNS = """
+    id, name, description, abbreviation, slug, keywords, common_requests
+"""
+
+# Full-text search of agencies, weighted in the following order:
+# abbreviation, name, description, keywords
+# (the weights are baked into search_vector). Ranks are cast from real to
+# float8, so that the rank kept in a page's cursor compares equal to the
+# rank of its row.
+AGENCY_TEXT_SEARCH = """
+    SELECT """ + AGENCY_SEARCH_COLUMNS + """,
+        ts_rank(search_vector, query)::float8 AS rank
+    FROM foia_hub_agency, to_tsquery('english', %s) AS query
+    WHERE search_vector @@ query
+"""
+
+# Fuzzy search of agencies, by the trigram similarity of the query to the
+# closest words of each column (word_similarity, and its `<%` operator), so
+# that a misspelt word isn't swamped by the rest of a long name
+AGENCY_FUZZY_SEARCH = """
+    SELECT """ + AGENCY_SEARCH_COLUMNS + """, GREATEST(
+        word_similarity(%s, name), word_similarity(%s, abbreviation),
+        word_similarity(%s, slug))::float8 AS rank
+    FROM foia_hub_agency
+    WHERE %s <%% name OR %s <%% abbreviation OR %s <%% slug
+"""
+
+# Full-text search of agencies and offices together
+TEXT_SEARCH = """
+    WITH search AS (SELECT to_tsquery('english', %s) AS query)
+    SELECT 'agency' AS is_a, a.name, a.slug, a.abbreviation,
+        NULL AS agency_name, NULL AS agency_slug, a.description,
+        ts_rank(a.search_vector, search.query)::float8 AS rank
+    FROM foia_hub_agency a, search
+    WHERE a.search_vector @@ search.query
+    UNION ALL
+    SELECT 'office' AS is_a, o.name, o.slug, NULL AS abbreviation,
+        a.name AS agency_name, a.slug AS agency_slug, NULL AS description,
+        ts_rank(o.search_vector, search.query)::float8 AS rank
+    FROM foia_hub_office o
+        JOIN foia_hub_agency a ON a.id = o.agency_id, search
+    WHERE o.search_vector @@ search.query
+"""
+
+# Fuzzy search of agencies and offices together
+FUZZY_SEARCH = """
+    SELECT 'agency' AS is_a, a.name, a.slug, a.abbreviation,
+        NULL AS agency_name, NULL AS agency_slug,
+        GREATEST(
+            word_similarity(%s, a.name), word_similarity(%s, a.abbreviation),
+            word_similarity(%s, a.slug))::float8 AS rank
+    FROM foia_hub_agency a
+    WHERE %s <%% a.name OR %s <%% a.abbreviation OR %s <%% a.slug
+    UNION ALL
+    SELECT 'office' AS is_a, o.name, o.slug, NULL AS abbreviation,
+        a.name AS agency_name, a.slug AS agency_slug,
+        GREATEST(
+            word_similarity(%s, o.name), word_similarity(%s, o.office_slug))
+            ::float8 AS rank
+    FROM foia_hub_office o
+        JOIN foia_hub_agency a ON a.id = o.agency_id
+    WHERE %s <%% o.name OR %s <%% o.office_slug
+"""
+
+
+# Columns of search results holding JSON
+JSON_COLUMNS = ('keywords', 'common_requests')
+
+# Rows fetched from the database at a time when streaming search results
+SEARCH_FETCH_SIZE = 500
+
+
+def row_mapper(description):
+    """ A function turning a row with the columns of a cursor's
+    `description` into a dict, decoding JSON columns. It is built once for a
+    query, so that each row is just zipped with the column names. """
+
+    columns = [col[0] for col in description]
+    json_columns = [i for i, c in enumerate(columns) if c in JSON_COLUMNS]
+
+    def to_dict(row):
+        if json_columns:
+            row = list(row)
+            for i in json_columns:
+                if row[i]:
+                    row[i] = loads(row[i])
+        return dict(zip(columns, row))
+    return to_dict
+
+
+def stream_rows(sql, params):
+    """ Runs `sql`, a Postgres search, yielding its rows as dicts. Rows are
+    fetched a batch at a time from a named (server-side) cursor, so a broad
+    search is never held in memory all at once as raw rows. """
+
+    connection.ensure_connection()
+    with transaction.atomic():
+        # Named cursors only live inside a transaction. Each gets its own
+        # name, as more than one search may be streaming at once.
+        raw = connection.connection.cursor(
+            name='foia_hub_search_%s' % uuid.uuid4().hex)
+        raw.itersize = SEARCH_FETCH_SIZE
+        if connection.queries_logged:
+            cursor = connection.make_debug_cursor(raw)
+        else:
+            cursor = CursorWrapper(raw, connection)
+        try:
+            cursor.execute(sql, params)
+            to_dict = None
+            for row in cursor:
+                if to_dict is None:
+                    to_dict = row_mapper(raw.description)
+                yield to_dict(row)
+        finally:
+            cursor.close()
+
+
+# Headlines (excerpts of the description, or else the name, with the matches
+# marked) are made for this many of the top results of a search
+HEADLINE_ROWS = 100
+
+HEADLINE_OPTIONS = 'StartSel="%s", StopSel="%s", MaxWords=35, MinWords=15' % (
+    START_SEL, STOP_SEL)
+
+# Wraps a page of text search results to add headlines. ts_headline is slow,
+# so it is only run for the top rows, after the page has been cut.
+HEADLINE_PAGE = """
+    SELECT page.*, CASE
+        WHEN row_number() OVER (ORDER BY rank DESC, {columns}) <= %s
+        THEN ts_headline(
+            'english', coalesce(page.description, page.name),
+            to_tsquery('english', %s), %s)
+        END AS headline
+    FROM ({page}) AS page
+    ORDER BY rank DESC, {columns}
+"""
+
+
+def add_highlights(rows):
+    """ Replaces the `headline` of each row that has one with a plain text
+    `snippet`, and a `highlight`: the same text as HTML, with the matches in
+    <mark> tags. """
+
+    for row in rows:
+        headline = row.pop('headline', None)
+        if headline is not None:
+            row['snippet'] = headline.replace(
+                START_SEL, '').replace(STOP_SEL, '')
+            row['highlight'] = escape(headline).replace(
+                START_SEL, '<mark>').replace(STOP_SEL, '</mark>')
+    return rows
+
+
+class HeadlinePreparer(FieldsPreparer):
+    """ Prepares search results, adding the `snippet` and `highlight` of
+    those that have them. """
+
+    def prepare(self, data):
+        result = super(HeadlinePreparer, self).prepare(data)
+        if isinstance(data, dict) and 'highlight' in data:
+            result['snippet'] = data['snippet']
+            result['highlight'] = data['highlight']
+        return result
+
+
 def contact_preparer():
     return FieldsPreparer(fields={
         'name': 'name',
@@ -115,15 +324,67 @@ def office_preparer():
     return preparer
 
 
+def agency_search_preparer():
+    return HeadlinePreparer(fields=agency_preparer().fields)
+
+
+def search_preparer():
+    return HeadlinePreparer(fields={
+        'is_a': 'is_a',
+        'name': 'name',
+        'slug': 'slug',
+        'abbreviation': 'abbreviation',
+        'agency_name': 'agency_name',
+        'agency_slug': 'agency_slug',
+    })
+
+
+def agency_detail_queryset():
+    """ Agencies, with everything the detail endpoint needs fetched up front:
+    the parent, child agencies, offices, the agency's own stats (newest
+    first) and reading rooms. This keeps the number of queries for an agency
+    fixed, however many components it has. """
+
+    return Agency.objects.select_related('parent').prefetch_related(
+        'agency_set',
+        'office_set',
+        'reading_room_urls',
+        Prefetch(
+            'stats_set',
+            queryset=Stats.objects.filter(office=None).order_by('-year'),
+            to_attr='latest_stats'),
+    )
+
+
+def office_detail_queryset():
+    """ Offices, with their agency, stats (newest first) and reading rooms
+    fetched up front. """
+
+    return Office.objects.select_related('agency').prefetch_related(
+        'reading_room_urls',
+        Prefetch(
+            'stats_set',
+            queryset=Stats.objects.order_by('-year'),
+            to_attr='latest_stats'),
+    )
+
+
 def get_latest_stats(stat_type, agency=None, office=None):
     """Gets the latest median processing time stats for an agency/office.
+    Uses the stats prefetched by `agency_detail_queryset` or
+    `office_detail_queryset` if they are there.
     """
 
-    if agency and not office:
+    contactable = office or agency
+    if hasattr(contactable, 'latest_stats'):
+        stats = next(
+            (s for s in contactable.latest_stats if s.stat_type == stat_type),
+            None)
+    elif agency and not office:
         stats = agency.stats_set \
             .filter(office=None, stat_type=stat_type) \
             .order_by('-year').first()
-    if office and not agency:
+    elif office and not agency:
         stats = office.stats_set \
             .filter(stat_type=stat_type) \
             .order_by('-year').first()
@@ -143,43 +404,281 @@ def foia_libraries_preparer(contactable):
     return data
 
 
-class AgencyResource(DjangoResource):
-    """ The resource that represents the endpoint for an Agency """
+def agency_document(agency):
+    """ The detail endpoint's document for an agency, fetched with
+    `agency_detail_queryset`. """
+
+    office_fields = office_preparer()
+    agency_fields = agency_preparer()
+
+    offices = []
+    for o in agency.get_all_components():
+        offices.append(office_fields.prepare(o))
+
+    simple = get_latest_stats(stat_type="S", agency=agency)
+    comp = get_latest_stats(stat_type="C", agency=agency)
+
+    data = {
+        'offices': offices,
+        'is_a': 'agency',
+        'agency_slug': agency.slug,
+        'agency_name': agency.name,
+        'no_records_about': agency.no_records_about,
+        'simple_processing_time': simple,
+        'complex_processing_time': comp,
+    }
+
+    # some agencies have parents (e.g. FBI->DOJ)
+    if agency.parent:
+        data['parent'] = agency_fields.prepare(agency.parent)
+
+    data.update(foia_libraries_preparer(agency))
+    data.update(agency_fields.prepare(agency))
+    data.update(contact_preparer().prepare(agency))
+    return data
+
+
+def office_document(office):
+    """ The detail endpoint's document for an office, fetched with
+    `office_detail_queryset`. """
+
+    office_data = office_preparer().prepare(office)
+
+    simple = get_latest_stats(stat_type="S", office=office)
+    comp = get_latest_stats(stat_type="C", office=office)
+
+    data = {
+        'agency_name': office.agency.name,
+        'agency_slug': office.agency.slug,
+        'office_slug': office.office_slug,
+        'agency_description': office.agency.description,
+        'is_a': 'office',
+        'simple_processing_time': simple,
+        'complex_processing_time': comp,
+    }
+
+    data.update(foia_libraries_preparer(office))
+    data.update(office_data)
+    data.update(contact_preparer().prepare(office))
+    return data
+
+
+def refresh_documents(agency_slugs=None):
+    """ Regenerates the stored `detail_document` of every agency and office,
+    or, given `agency_slugs`, of those agencies, their parents and child
+    agencies, and all of their offices. Only documents that have changed are
+    written. Returns the number written. """
+
+    agencies = agency_detail_queryset()
+    offices = office_detail_queryset()
+    if agency_slugs is not None:
+        agency_slugs = set(agency_slugs)
+        agency_slugs.update(Agency.objects.filter(
+            Q(parent__slug__in=agency_slugs) |
+            Q(agency__slug__in=agency_slugs)
+        ).values_list('slug', flat=True))
+        agencies = agencies.filter(slug__in=agency_slugs)
+        offices = offices.filter(agency__slug__in=agency_slugs)
+
+    written = 0
+    for contactables, build in ((agencies, agency_document),
+                                (offices, office_document)):
+        for contactable in contactables:
+            document = build(contactable)
+            if contactable.detail_document != document:
+                contactables.model.objects.filter(
+                    pk=contactable.pk).update(detail_document=document)
+                written += 1
+    return written
+
+
+def get_document(model, detail_queryset, build, slug):
+    """ The stored detail document for the agency or office with `slug`.
+    Documents are generated when contact data are loaded or saved; one that
+    hasn't been yet is built on the spot. """
+
+    contactable = get_object_or_404(
+        model.objects.only('detail_document'), slug=slug)
+    if contactable.detail_document is not None:
+        return contactable.detail_document
+    return build(detail_queryset().get(pk=contactable.pk))
+
+
+def typeahead_json(agencies):
+    """ The typeahead feed of `agencies`, (name, abbreviation, slug) rows in
+    name order, and its version, a hash of its content. """
+
+    feed = dumps({
+        'fields': ['name', 'abbreviation', 'slug'],
+        'agencies': [list(a) for a in agencies],
+    }, separators=(',', ':'))
+    version = hashlib.sha1(feed.encode('utf-8')).hexdigest()[:12]
+    return feed, version
+
+
+def typeahead_feed():
+    """ The agencies for the search box's typeahead, as compact JSON: just
+    the name, abbreviation and slug of each agency, as an array. Returns the
+    JSON and its version. Cached for the current data generation. """
+
+    if settings.DATA_SNAPSHOT:
+        return get_snapshot().typeahead
+
+    return cached(
+        cache_key('typeahead'),
+        lambda: typeahead_json(Agency.objects.order_by('name').values_list(
+            'name', 'abbreviation', 'slug')))
+
+
+# The modules that answer searches for SEARCH_BACKENDs other than 'database'
+SEARCH_INDEXES = {
+    'memory': search_index,
+    'replica': replica,
+}
+
+# Lists are returned a page at a time
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(key):
+    """ An opaque cursor for a page starting after the row with the sort
+    `key` (a list of values). """
+
+    return base64.urlsafe_b64encode(
+        dumps(key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """ The sort key in `cursor`. Raises BadRequest if it isn't a cursor. """
+
+    try:
+        key = loads(base64.urlsafe_b64decode(
+            cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, UnicodeError):
+        key = None
+    if not isinstance(key, list):
+        raise BadRequest(msg="Invalid cursor")
+    return key
+
+
+def is_key(key, types):
+    """ Whether the sort `key` from a cursor has values of the given
+    `types`, so it belongs to a list sorted that way. """
+
+    return len(key) == len(types) and all(
+        isinstance(v, t) for v, t in zip(key, types))
+
+
+def check_key(key, types):
+    """ Returns the sort `key` from a cursor, unless it doesn't have values
+    of the given `types`, when BadRequest is raised. """
+
+    if not is_key(key, types):
+        raise BadRequest(msg="Invalid cursor")
+    return key
+
 
-    preparer = agency_preparer()
-
-    def __init__(self, *args, **kwargs):
-        super(AgencyResource, self).__init__(*args, **kwargs)
-        self.office_preparer = office_preparer()
-        self.contact_preparer = contact_preparer()
-
-    def prepare_agency_contact(self, agency):
-        offices = []
-        components = agency.get_all_components()
-        for o in components:
-            offices.append(self.office_preparer.prepare(o))
-
-        simple = get_latest_stats(stat_type="S", agency=agency)
-        comp = get_latest_stats(stat_type="C", agency=agency)
-
-        data = {
-            'offices': offices,
-            'is_a': 'agency',
-            'agency_slug': agency.slug,
-            'agency_name': agency.name,
-            'no_records_about': agency.no_records_about,
-            'simple_processing_time': simple,
-            'complex_processing_time': comp,
+def paginate(rows, limit, key):
+    """ Splits `rows`, fetched with one more row than the page `limit`, into
+    the page and the cursor for the next page (or None on the last page).
+    `key` gives a row's sort key. """
+
+    rows = list(rows)
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
+
+
+def ranked_page(sql, params, mode, key, limit, order=('id',),
+                headline_query=None):
+    """ A page of up to `limit` rows of `sql`, a search whose rows have a
+    `rank`, following the sort `key`. Rows are ordered by rank, highest
+    first, then by the `order` columns. Cursors start with the search `mode`,
+    so that the next page is searched for the same way. Given the
+    `headline_query` (a tsquery), the top rows are highlighted. """
+
+    sql = 'SELECT * FROM (%s) AS results' % sql
+    params = list(params)
+    columns = ', '.join(order)
+    if key:
+        sql += " WHERE rank < %s OR (rank = %s AND ({0}) > ({1}))".format(
+            columns, ', '.join(['%s'] * len(order)))
+        params += [key[1], key[1]] + key[2:]
+    sql += " ORDER BY rank DESC, " + columns
+    if limit:
+        sql += " LIMIT %s"
+        params.append(limit + 1)
+    if headline_query:
+        sql = HEADLINE_PAGE.format(columns=columns, page=sql)
+        params = [HEADLINE_ROWS, headline_query, HEADLINE_OPTIONS] + params
+
+    rows, next_cursor = paginate(
+        stream_rows(sql, params), limit,
+        lambda r: [mode, r['rank']] + [r[c] for c in order])
+    return add_highlights(rows), next_cursor
+
+
+def headlines(rows, search_term):
+    """ Highlights the top rows of a page from the in-memory index or the
+    replica, as `ranked_page` does for the database. """
+
+    for row in rows[:HEADLINE_ROWS]:
+        row['headline'] = search_index.headline(
+            row['description'] or row['name'], search_term)
+    return add_highlights(rows)
+
+
+def search_mode(key, types):
+    """ The search mode that the sort `key` from a cursor was ranked by,
+    checking that it's a key of the given `types`. """
+
+    mode = check_key(key, (str, float) + types)[0]
+    if mode not in ('text', 'fuzzy'):
+        raise BadRequest(msg="Invalid cursor")
+    return mode
+
+
+class PaginatedResource(DjangoResource):
+    """ A resource whose list is returned a page at a time, using keyset
+    pagination: rather than an offset, the `cursor` parameter holds the sort
+    key of the last row of the previous page. The page size is set with
+    `limit` (up to MAX_PAGE_SIZE), and each page links to the `next` one in
+    its `meta`. """
+
+    next_cursor = None
+
+    def page_limit(self):
+        limit = PAGE_SIZE
+        if self.request and self.request.GET.get('limit'):
+            try:
+                limit = int(self.request.GET['limit'])
+            except ValueError:
+                raise BadRequest(msg="limit must be a number")
+        return max(1, min(limit, MAX_PAGE_SIZE))
+
+    def page_cursor(self):
+        if self.request:
+            return self.request.GET.get('cursor') or None
+        return None
+
+    def wrap_list_response(self, data):
+        next_url = None
+        if self.next_cursor:
+            params = self.request.GET.copy()
+            params['cursor'] = self.next_cursor
+            next_url = '%s?%s' % (self.request.path, params.urlencode())
+        return {
+            'objects': data,
+            'meta': {'next': next_url},
         }
 
-        # some agencies have parents (e.g. FBI->DOJ)
-        if agency.parent:
-            data['parent'] = AgencyResource.preparer.prepare(agency.parent)
 
-        data.update(foia_libraries_preparer(agency))
-        data.update(AgencyResource.preparer.prepare(agency))
-        data.update(self.contact_preparer.prepare(agency))
-        return data
+class AgencyResource(PaginatedResource):
+    """ The resource that represents the endpoint for an Agency """
+
+    preparer = agency_search_preparer()
 
     def list(self, q=None):
         """
@@ -188,7 +687,13 @@ class AgencyResource(DjangoResource):
         instead limiting the output to useful fields. To see the detail for
         each object, use the detail endpoint.
 
-        Full-text-search - queries are made in Postgres tsearch2.
+        Full-text-search - queries are made in Postgres tsearch2, against
+        the GIN-indexed `search_vector` column that a trigger keeps current
+        (see migration 0023). With the `memory` SEARCH_BACKEND, they are
+        answered from an index kept by each worker instead (see
+        foia_hub.search), which works with any database, and with the
+        `replica` one, from the FTS5 index of the read replica (see
+        foia_hub.replica).
 
         Capabilities
         - Fields Searched: name, slug, abbreviation, description
@@ -203,57 +708,129 @@ class AgencyResource(DjangoResource):
             - Parenthesis are removed and have no effect
             - Quotes are removed and have no effect
             - all keywords must at least have an empty list `[]`
+
+        Results come a page at a time (see PaginatedResource), ordered by
+        name, or by rank when searching, and are cached for the current data
+        generation. In DATA_SNAPSHOT mode, the unfiltered list comes from
+        the worker's snapshot instead (see foia_hub.snapshot).
         """
 
         # Use request 'query' parameter if it exists
         if self.request and 'query' in self.request.GET:
             q = self.request.GET.get('query', None)
 
-        if q:
+        agencies, self.next_cursor = self.cached_page(
+            q, self.page_cursor(), self.page_limit())
+        return agencies
+
+    def cached_page(self, q, after, limit):
+        """ A page of `find_agencies` for the `search_text` of `q`, cached
+        for the current data generation. """
+
+        q = search_text(q)
+        if q == '':
+            return [], None
+        if not q and settings.DATA_SNAPSHOT:
+            return self.find_agencies(q, after, limit)
+        return cached_search(
+            cache_key('agency-list', q, after, limit),
+            lambda: self.find_agencies(q, after, limit))
+
+    def all_agencies(self, q=None):
+        """ Every agency, or every agency matching the `search_text` of `q`,
+        for the agencies page. """
+
+        q = search_text(q)
+        if q == '':
+            return []
+        if not q and settings.DATA_SNAPSHOT:
+            return self.find_agencies(q)[0]
+        return cached_search(
+            cache_key('agency-list', q),
+            lambda: self.find_agencies(q)[0])
+
+    def find_agencies(self, q, after=None, limit=None):
+        """ Does the work of `list`, returning a page of up to `limit`
+        agencies (all of them, by default) following the `after` cursor,
+        and the cursor for the next page. """
+
+        key = decode_cursor(after) if after else None
+
+        if not q and settings.DATA_SNAPSHOT:
+            if key:
+                check_key(key, (str, int))
+            return paginate(
+                get_snapshot().agency_page(key, limit), limit,
+                lambda a: [a.name, a.id])
+
+        index = SEARCH_INDEXES.get(settings.SEARCH_BACKEND)
+        if q and index:
+            if key:
+                search_mode(key, (int,))
             search_term = sanitize_search_term(q)
-            cursor = connection.cursor()
-            # full text search weighted in following order:
-            # abbreviation, name, description, keywords
-            try:
-                cursor.execute(
-                    """
-        SELECT *
-        FROM (
-            SELECT * ,
-                setweight(to_tsvector('simple', slug), 'A') ||
-                setweight(to_tsvector('english', name), 'A') ||
-                setweight(to_tsvector('simple', abbreviation), 'A') ||
-                setweight(to_tsvector('english', description), 'B') ||
-                setweight(to_tsvector('simple', keywords), 'C') as tsvect
-            FROM foia_hub_agency
-            ) as results
-        WHERE results.tsvect @@ to_tsquery('english', %s)
-        ORDER BY ts_rank(results.tsvect, to_tsquery('english', %s)) DESC;
-                    """,
-                    [search_term, search_term])
-                agencies = dictfetchall(cursor)
-
-            # Defaults to extact text search if search fails
-            except:
-                agencies = Agency.objects.filter(
-                    Q(abbreviation__icontains=q) |
-                    Q(name__icontains=q) |
-                    Q(slug__icontains=q) |
-                    Q(keywords__icontains=q) |
-                    Q(description__icontains=q)
-                )
+            agencies, next_cursor = paginate(
+                index.search_agencies(search_term, key, limit), limit,
+                lambda a: ['text', a['rank'], a['id']])
+            return headlines(agencies, search_term), next_cursor
 
-        else:
-            agencies = Agency.objects.all().order_by('name')
+        if q and connection.vendor == 'postgresql':
+            return self.search_agencies(q, key, limit)
 
-        return agencies
+        # Other databases fall back to exact text search
+        if q:
+            agencies = Agency.objects.filter(
+                Q(abbreviation__icontains=q) |
+                Q(name__icontains=q) |
+                Q(slug__icontains=q) |
+                Q(keywords__icontains=q) |
+                Q(description__icontains=q)
+            )
+        else:
+            agencies = Agency.objects.all()
+
+        agencies = agencies.defer('detail_document').order_by('name', 'id')
+        if key:
+            name, pk = check_key(key, (str, int))
+            agencies = agencies.filter(
+                Q(name__gt=name) | Q(name=name, id__gt=pk))
+        if limit:
+            agencies = agencies[:limit + 1]
+        return paginate(agencies, limit, lambda a: [a.name, a.id])
+
+    def search_agencies(self, q, key, limit):
+        """ A ranked page of agencies matching `q`, following the sort `key`.
+        If `q` is a valid text search that finds something, it's a full-text
+        search. Otherwise agencies with words in their names, abbreviations
+        or slugs similar to `q` are found, ranked by trigram word similarity,
+        so that misspellings still find something. Both are indexed. """
+
+        mode = search_mode(key, (int,)) if key else 'text'
+        if mode == 'text':
+            search_term = sanitize_search_term(q)
+            if is_valid_tsquery(search_term):
+                agencies, next_cursor = ranked_page(
+                    AGENCY_TEXT_SEARCH, [search_term], 'text', key, limit,
+                    headline_query=search_term)
+                if agencies or key:
+                    return agencies, next_cursor
+            elif key:
+                raise BadRequest(msg="Invalid cursor")
+
+        # Without a letter or number, there is nothing to be similar to
+        if not word_re.search(q):
+            return [], None
+        return ranked_page(AGENCY_FUZZY_SEARCH, [q] * 6, 'fuzzy', key, limit)
 
     @skip_prepare
     def detail(self, slug):
         """ A detailed return of an Agency objects. """
-        agency = get_object_or_404(Agency, slug=slug)
-        response = self.prepare_agency_contact(agency)
-        return response
+
+        if settings.DATA_SNAPSHOT:
+            return get_snapshot().agency_document(slug)
+        return cached(
+            cache_key('agency-detail', slug),
+            lambda: get_document(
+                Agency, agency_detail_queryset, agency_document, slug))
 
     @classmethod
     def urls(cls, name_prefix=None):
@@ -271,39 +848,16 @@ class AgencyResource(DjangoResource):
 class OfficeResource(DjangoResource):
     """ The resource that represents the endpoint for an Office. """
 
-    def __init__(self, *args, **kwargs):
-        super(OfficeResource, self).__init__(*args, **kwargs)
-        self.agency_preparer = agency_preparer()
-        self.office_preparer = office_preparer()
-        self.contact_preparer = contact_preparer()
-
     @skip_prepare
     def detail(self, slug):
         """ A detailed return of an Office object. """
-        office = get_object_or_404(Office, slug=slug)
-        response = self.prepare_office_contact(office)
-        return response
-
-    def prepare_office_contact(self, office):
-        office_data = self.office_preparer.prepare(office)
-
-        simple = get_latest_stats(stat_type="S", office=office)
-        comp = get_latest_stats(stat_type="C", office=office)
-
-        data = {
-            'agency_name': office.agency.name,
-            'agency_slug': office.agency.slug,
-            'office_slug': office.office_slug,
-            'agency_description': office.agency.description,
-            'is_a': 'office',
-            'simple_processing_time': simple,
-            'complex_processing_time': comp,
-        }
 
-        data.update(foia_libraries_preparer(office))
-        data.update(office_data)
-        data.update(self.contact_preparer.prepare(office))
-        return data
+        if settings.DATA_SNAPSHOT:
+            return get_snapshot().office_document(slug)
+        return cached(
+            cache_key('office-detail', slug),
+            lambda: get_document(
+                Office, office_detail_queryset, office_document, slug))
 
     @classmethod
     def urls(cls, name_prefix=None):
@@ -318,7 +872,183 @@ class OfficeResource(DjangoResource):
         ) + urlpatterns
 
 
-class FOIARequestResource(DjangoResource):
+class SearchResource(PaginatedResource):
+    """ The resource that represents the endpoint for searching Agencies and
+    Offices together. """
+
+    preparer = search_preparer()
+
+    def list(self, q=None):
+        """
+        Searches Agency and Office objects together, ranking both kinds of
+        result against each other. Each result carries `is_a` and `slug`, so
+        it can be routed to the agency or office detail endpoint.
+
+        Uses the same weighting and query syntax as `AgencyResource.list`,
+        against the GIN-indexed `search_vector` columns of both tables. If
+        the full-text search can't be run, falls back to a case-insensitive
+        match on names, abbreviations and slugs.
+
+        Results come a page at a time (see PaginatedResource), and are
+        cached for the current data generation.
+        """
+
+        # Use request 'query' parameter if it exists
+        if self.request and 'query' in self.request.GET:
+            q = self.request.GET.get('query', None)
+
+        if not q:
+            return []
+
+        results, self.next_cursor = self.cached_page(
+            q, self.page_cursor(), self.page_limit())
+        return results
+
+    def cached_page(self, q, after, limit):
+        """ A page of `search` for the `search_text` of `q`, cached for the
+        current data generation. """
+
+        q = search_text(q)
+        if not q:
+            return [], None
+        return cached_search(
+            cache_key('search', q, after, limit),
+            lambda: self.search(q, after, limit))
+
+    def search(self, q, after=None, limit=None):
+        """ Does the work of `list`, returning a page of up to `limit`
+        results (all of them, by default) following the `after` cursor, and
+        the cursor for the next page. Results are ordered by rank, then name
+        and slug, which is unique across agencies and offices. """
+
+        key = decode_cursor(after) if after else None
+
+        index = SEARCH_INDEXES.get(settings.SEARCH_BACKEND)
+        if index:
+            if key:
+                search_mode(key, (str, str))
+            search_term = sanitize_search_term(q)
+            results, next_cursor = paginate(
+                index.search(search_term, key, limit), limit,
+                lambda r: ['text', r['rank'], r['name'], r['slug']])
+            return headlines(results, search_term), next_cursor
+
+        if connection.vendor == 'postgresql':
+            return self.ranked_search(q, key, limit)
+
+        # Other databases fall back to exact text search
+        agencies = Agency.objects.filter(
+            Q(abbreviation__icontains=q) |
+            Q(name__icontains=q) |
+            Q(slug__icontains=q)
+        ).values('name', 'slug', 'abbreviation')
+        offices = Office.objects.filter(
+            Q(name__icontains=q) |
+            Q(office_slug__icontains=q)
+        ).values('name', 'slug', 'agency__name', 'agency__slug')
+
+        if key:
+            name, slug = check_key(key, (str, str))
+            following = Q(name__gt=name) | Q(name=name, slug__gt=slug)
+            agencies = agencies.filter(following)
+            offices = offices.filter(following)
+        agencies = agencies.order_by('name', 'slug')
+        offices = offices.order_by('name', 'slug')
+        if limit:
+            agencies = agencies[:limit + 1]
+            offices = offices[:limit + 1]
+
+        results = []
+        for agency in agencies:
+            results.append({
+                'is_a': 'agency',
+                'name': agency['name'],
+                'slug': agency['slug'],
+                'abbreviation': agency['abbreviation'],
+                'agency_name': None,
+                'agency_slug': None,
+            })
+        for office in offices:
+            results.append({
+                'is_a': 'office',
+                'name': office['name'],
+                'slug': office['slug'],
+                'abbreviation': None,
+                'agency_name': office['agency__name'],
+                'agency_slug': office['agency__slug'],
+            })
+        results.sort(key=lambda r: (r['name'], r['slug']))
+        if limit:
+            results = results[:limit + 1]
+        return paginate(
+            results, limit, lambda r: [r['name'], r['slug']])
+
+    def ranked_search(self, q, key, limit):
+        """ A ranked page of results for `q`, following the sort `key`: a
+        full-text search, or a fuzzy one, as for
+        `AgencyResource.search_agencies`. """
+
+        order = ('name', 'slug')
+        mode = search_mode(key, (str, str)) if key else 'text'
+        if mode == 'text':
+            search_term = sanitize_search_term(q)
+            if is_valid_tsquery(search_term):
+                results, next_cursor = ranked_page(
+                    TEXT_SEARCH, [search_term], 'text', key, limit, order,
+                    headline_query=search_term)
+                if results or key:
+                    return results, next_cursor
+            elif key:
+                raise BadRequest(msg="Invalid cursor")
+
+        if not word_re.search(q):
+            return [], None
+        return ranked_page(FUZZY_SEARCH, [q] * 10, 'fuzzy', key, limit, order)
+
+
+def popular_queries(path, count):
+    """ The `count` searches made most often according to the query log at
+    `path`, most popular first, as (endpoint, query) pairs. Searches are
+    counted by their normalized form, and the most common way of writing
+    each one is returned. """
+
+    counts = Counter()
+    spellings = defaultdict(Counter)
+    with open(path) as log:
+        for line in log:
+            try:
+                entry = loads(line)
+                search = (entry['endpoint'], normalize_query(entry['query']))
+            except (ValueError, KeyError, TypeError):
+                continue
+            counts[search] += 1
+            spellings[search][entry['query']] += 1
+    return [
+        (search[0], spellings[search].most_common(1)[0][0])
+        for search, _ in counts.most_common(count)]
+
+
+def prewarm_searches(path=None, count=None):
+    """ Runs the most popular searches in the query log (SEARCH_QUERY_LOG,
+    by default), so that their first pages are cached for the current data
+    generation before anyone asks. Returns the number of searches run. """
+
+    path = path or settings.SEARCH_QUERY_LOG
+    if not path or not os.path.exists(path):
+        return 0
+
+    searches = popular_queries(path, count or settings.SEARCH_PREWARM_COUNT)
+    for endpoint, q in searches:
+        if endpoint == 'agencies':
+            AgencyResource().all_agencies(q)
+        elif endpoint == 'agency':
+            AgencyResource().cached_page(q, None, PAGE_SIZE)
+        else:
+            SearchResource().cached_page(q, None, PAGE_SIZE)
+    return len(searches)
+
+
+class FOIARequestResource(PaginatedResource):
 
     preparer = FieldsPreparer(fields={
         'status': 'status',
@@ -395,7 +1125,17 @@ class FOIARequestResource(DjangoResource):
 
     # GET /
     def list(self):
-        return FOIARequest.objects.all()
+        """ FOIA requests, a page at a time, oldest first. """
+
+        limit = self.page_limit()
+        requests = FOIARequest.objects.order_by('id')
+        after = self.page_cursor()
+        if after:
+            pk, = check_key(decode_cursor(after), (int,))
+            requests = requests.filter(id__gt=pk)
+        requests, self.next_cursor = paginate(
+            requests[:limit + 1], limit, lambda r: [r.pk])
+        return requests
 
     # Open everything wide!
     # DANGEROUS, DO NOT DO IN PRODUCTION.
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class FoiaHubConfig(AppConfig):
+    name = 'foia_hub'
+
+    def ready(self):
+        # Connects the handlers that keep detail documents up to date
+        import foia_hub.signals  # noqa
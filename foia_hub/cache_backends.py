@@ -0,0 +1,166 @@
+""" A two-tier cache backend: a small, short-lived LRU cache in each worker's
+memory, in front of a cache shared by every worker (the filebased cache, or a
+networked one). Hot values, like popular agency pages, are then served
+without touching the shared cache at all.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'foia_hub.cache_backends.TieredCache',
+            'OPTIONS': {
+                'SHARED_CACHE': 'shared',
+                'LOCAL_MAX_ENTRIES': 200,
+                'LOCAL_TIMEOUT': 60,
+            },
+        },
+        'shared': {...},
+    }
+
+Values are only kept locally for LOCAL_TIMEOUT seconds, so a value changed
+by another worker is seen within that time. The data generation is never
+kept locally, and when it changes every local value is dropped. Neither are
+the locks used to coordinate workers (keys ending in SHARED_ONLY_SUFFIXES).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+
+class LocalStore(object):
+    """ The in-memory tier, shared by the threads of a worker. Values are
+    kept as they are, rather than pickled, so that a hit costs no more than a
+    dict lookup; callers must treat them as read-only, as they're shared. """
+
+    def __init__(self):
+        self.values = OrderedDict()
+        self.generation = None
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self.values[key]
+                return None
+            self.values.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout, max_entries):
+        with self.lock:
+            self.values[key] = (time.time() + timeout, value)
+            self.values.move_to_end(key)
+            while len(self.values) > max_entries:
+                self.values.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(name):
+    with _stores_lock:
+        if name not in _stores:
+            _stores[name] = LocalStore()
+        return _stores[name]
+
+
+class TieredCache(BaseCache):
+
+    def __init__(self, location, params):
+        super(TieredCache, self).__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = options.get('SHARED_CACHE', 'shared')
+        self.local_max_entries = int(options.get('LOCAL_MAX_ENTRIES', 200))
+        self.local_timeout = int(options.get('LOCAL_TIMEOUT', 60))
+        self.generation_key = options.get('GENERATION_KEY', 'data-generation')
+        self.shared_only_suffixes = tuple(options.get(
+            'SHARED_ONLY_SUFFIXES', (':lock', ':refresh')))
+        self.store = get_store(location or self.shared_alias)
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def kept_locally(self, key):
+        return not (key == self.generation_key or
+                    key.endswith(self.shared_only_suffixes))
+
+    def local_key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def keep(self, key, value, version, timeout=DEFAULT_TIMEOUT):
+        """ Keeps `value` locally, for no longer than the shared cache
+        will. """
+
+        local_timeout = self.local_timeout
+        if timeout is not DEFAULT_TIMEOUT and timeout is not None:
+            local_timeout = min(local_timeout, timeout)
+        if local_timeout > 0:
+            self.store.set(
+                self.local_key(key, version), value, local_timeout,
+                self.local_max_entries)
+
+    def check_generation(self, generation):
+        """ Drops every local value when the data generation changes. """
+
+        if generation != self.store.generation:
+            if self.store.generation is not None:
+                self.store.clear()
+            self.store.generation = generation
+
+    def get(self, key, default=None, version=None):
+        if not self.kept_locally(key):
+            value = self.shared.get(key, version=version)
+            if key == self.generation_key and value is not None:
+                self.check_generation(value)
+            return default if value is None else value
+
+        value = self.store.get(self.local_key(key, version))
+        if value is not None:
+            return value
+        value = self.shared.get(key, version=version)
+        if value is None:
+            return default
+        self.keep(key, value, version)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout=timeout, version=version)
+        if key == self.generation_key:
+            self.check_generation(value)
+        elif self.kept_locally(key):
+            self.keep(key, value, version, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # Only the shared cache can say whether the key was there already
+        added = self.shared.add(key, value, timeout=timeout, version=version)
+        if added and self.kept_locally(key):
+            self.keep(key, value, version, timeout)
+        return added
+
+    def delete(self, key, version=None):
+        self.store.delete(self.local_key(key, version))
+        self.shared.delete(key, version=version)
+
+    def clear(self):
+        self.store.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
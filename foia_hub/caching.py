@@ -0,0 +1,279 @@
+""" Caching of contact data. Cache keys include the data generation, which
+is bumped whenever contact data change, so cached data can be kept for a long
+time and still be dropped as soon as they're out of date. """
+
+import hashlib
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from foia_hub.models import DataGeneration
+
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'data-generation'
+
+# How often a worker waiting for another's result checks for it
+SINGLE_FLIGHT_POLL_SECONDS = 0.05
+
+
+def get_cache():
+    return caches[settings.CACHE_MIDDLEWARE_ALIAS]
+
+
+def get_generation():
+    """ The current data generation. It is kept in the cache for a few
+    seconds, so that most requests don't need to ask the database. """
+
+    cache = get_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = DataGeneration.objects.values_list(
+            'generation', flat=True).first() or 0
+        cache.set(
+            GENERATION_KEY, generation,
+            settings.DATA_GENERATION_CACHE_SECONDS)
+    return generation
+
+
+def bump_generation(agencies=None, offices=None):
+    """ Moves on to a new data generation, so that everything cached for the
+    previous one is no longer used, and tells every worker so (see
+    `publish_invalidation`). `agencies` and `offices` are the slugs of what
+    changed, if known. """
+
+    bumped = DataGeneration.objects.filter(pk=1).update(
+        generation=F('generation') + 1)
+    if not bumped:
+        try:
+            with transaction.atomic():
+                DataGeneration.objects.create(pk=1, generation=1)
+        except IntegrityError:
+            # Someone else created it first
+            DataGeneration.objects.filter(pk=1).update(
+                generation=F('generation') + 1)
+    get_cache().delete(GENERATION_KEY)
+    publish_invalidation(agencies, offices)
+
+
+def cache_key(name, *parts):
+    """ A cache key for `name` and `parts` at the current data generation.
+    Parts that may not be safe in a cache key (such as search terms) are
+    hashed. """
+
+    digest = hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+    return 'contacts:%s:%s:%s' % (get_generation(), name, digest)
+
+
+def cached(key, compute):
+    """ Returns the value cached under `key`, or computes, caches and returns
+    it. `None` is not cached.
+
+    Only one worker computes a missing value at a time. It holds a short
+    lock in the cache while it does; the others wait for its result, rather
+    than all asking the database at once when a popular value expires. """
+
+    cache = get_cache()
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = key + ':lock'
+    if not cache.add(lock_key, 1, settings.SINGLE_FLIGHT_LOCK_SECONDS):
+        value = wait_for(cache, key, lock_key)
+        if value is not None:
+            return value
+        # Whoever held the lock gave up, or is taking too long. The lock is
+        # still theirs to release.
+        return compute_and_set(cache, key, compute)
+
+    try:
+        return compute_and_set(cache, key, compute)
+    finally:
+        cache.delete(lock_key)
+
+
+def compute_and_set(cache, key, compute):
+    value = compute()
+    if value is not None:
+        cache.set(key, value, settings.DATA_CACHE_SECONDS)
+    return value
+
+
+def wait_for(cache, key, lock_key):
+    """ Waits for the value of `key` while `lock_key` is held, for up to
+    SINGLE_FLIGHT_WAIT_SECONDS. Returns the value, or None if it doesn't
+    come. """
+
+    deadline = time.time() + settings.SINGLE_FLIGHT_WAIT_SECONDS
+    while time.time() < deadline:
+        time.sleep(SINGLE_FLIGHT_POLL_SECONDS)
+        values = cache.get_many([key, lock_key])
+        if key in values or lock_key not in values:
+            return values.get(key)
+    return None
+
+
+class LRUCache(object):
+    """ A small cache kept by each worker, holding the `size` most recently
+    used values, which counts its hits and misses. """
+
+    def __init__(self, size):
+        self.size = size
+        self.values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.values.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.values.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.values[key] = value
+            self.values.move_to_end(key)
+            while len(self.values) > self.size:
+                self.values.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+            self.hits = self.misses = 0
+
+    def hit_ratio(self):
+        """ The fraction of lookups that were hits, or None before any. """
+
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+
+# Search traffic is dominated by a few popular queries, so their results are
+# kept by each worker as well as in the shared cache.
+search_results = LRUCache(settings.SEARCH_CACHE_SIZE)
+
+
+def cached_search(key, compute):
+    """ As `cached`, for search results, which are first looked for among the
+    worker's recent searches. Keys include the data generation, so results
+    from older generations are simply never asked for again, and evicted. """
+
+    value = search_results.get(key)
+    if value is None:
+        value = cached(key, compute)
+        if value is not None:
+            search_results.set(key, value)
+    return value
+
+
+# Invalidation across workers and instances. Each worker only looks for a new
+# data generation every DATA_GENERATION_CACHE_SECONDS, and instances don't
+# share a cache. So on Postgres, a new generation is also announced with
+# NOTIFY, and a thread in each worker LISTENs for it, so that every worker
+# moves on to the new generation straight away.
+
+INVALIDATION_CHANNEL = 'foia_hub_invalidation'
+
+# NOTIFY payloads must be shorter than 8000 bytes
+MAX_PAYLOAD_BYTES = 7999
+
+
+def publish_invalidation(agencies=None, offices=None):
+    """ Sends the slugs of the agencies (with their offices) and offices
+    whose contact data changed, as JSON, to every listening worker. `None`
+    means they're not known: anything may have changed. The notification is
+    sent when the current transaction commits. """
+
+    if connection.vendor != 'postgresql':
+        return
+
+    message = {
+        'agencies': sorted(agencies) if agencies is not None else None,
+        'offices': sorted(offices) if offices is not None else None,
+    }
+    payload = json.dumps(message, sort_keys=True)
+    if len(payload.encode('utf-8')) > MAX_PAYLOAD_BYTES:
+        payload = json.dumps({'agencies': None, 'offices': None})
+    cursor = connection.cursor()
+    cursor.execute('SELECT pg_notify(%s, %s)', [INVALIDATION_CHANNEL, payload])
+
+
+def invalidate(payload):
+    """ Handles a notification from `publish_invalidation`: forgets the data
+    generation, so that it's looked up again by the next request, and drops
+    this worker's search results. Every other cached value is keyed by the
+    generation, so it is then no longer used. Returns the message. """
+
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        message = {}
+    get_cache().delete(GENERATION_KEY)
+    search_results.clear()
+    logger.info(
+        'Contact data changed (agencies: %s, offices: %s)',
+        message.get('agencies', 'all'), message.get('offices', 'all'))
+    return message
+
+
+def listen():
+    """ Handles notifications from `publish_invalidation` as they come, for
+    good, in the thread's own database connection. If the connection is
+    lost, listens again after INVALIDATION_RETRY_SECONDS. """
+
+    while True:
+        try:
+            connection.ensure_connection()
+            connection.cursor().execute('LISTEN %s' % INVALIDATION_CHANNEL)
+            pg_connection = connection.connection
+            while True:
+                select.select([pg_connection], [], [], 60)
+                pg_connection.poll()
+                while pg_connection.notifies:
+                    invalidate(pg_connection.notifies.pop(0).payload)
+        except Exception:
+            logger.exception('Lost the invalidation listener connection')
+            connection.close()
+            time.sleep(settings.INVALIDATION_RETRY_SECONDS)
+
+
+_listener = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def start_listener():
+    """ Starts listening for invalidations in a background thread, once per
+    worker process, on Postgres. Threads aren't carried over into forked
+    processes, so this is called from each worker's requests (see
+    `foia_hub.middleware.InvalidationListenerMiddleware`) rather than when
+    the application is loaded, which gunicorn's --preload does before
+    forking. """
+
+    global _listener, _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid or connection.vendor != 'postgresql':
+        return
+    with _listener_lock:
+        if _listener_pid != pid:
+            _listener = threading.Thread(
+                target=listen, name='foia-hub-invalidation')
+            _listener.daemon = True
+            _listener.start()
+            _listener_pid = pid
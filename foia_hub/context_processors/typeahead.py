@@ -0,0 +1,11 @@
+from django.core.urlresolvers import reverse
+
+from foia_hub.api import typeahead_feed
+
+
+def typeahead(request):
+    """ The URL of the current version of the typeahead feed, so the search
+    box can keep the feed until the data change. """
+
+    feed, version = typeahead_feed()
+    return {'typeahead_url': reverse('typeahead', args=[version])}
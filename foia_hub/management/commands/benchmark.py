@@ -0,0 +1,94 @@
+import json
+import optparse
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_test_environment, teardown_test_environment)
+
+from foia_hub.scripts.benchmark import DEFAULT_SCALES, compare, run_benchmarks
+
+
+class Command(BaseCommand):
+
+    help = """ Benchmarks contact loading, the API and the contact pages
+    against synthetic data, in a throwaway test database.
+        django-admin.py benchmark --scales=100,1000 --output=results.json
+    To fail if anything has become slower than a saved run:
+        django-admin.py benchmark --baseline=results.json
+    """
+
+    option_list = BaseCommand.option_list + (
+        optparse.make_option(
+            "--scales",
+            dest="scales",
+            default=",".join(str(s) for s in DEFAULT_SCALES),
+            help="comma separated numbers of agencies to benchmark with"
+        ),
+        optparse.make_option(
+            "--repeat",
+            dest="repeat",
+            type="int",
+            default=5,
+            help="how many times to time each benchmark"
+        ),
+        optparse.make_option(
+            "--output",
+            dest="output",
+            help="file to write the results to, as JSON"
+        ),
+        optparse.make_option(
+            "--baseline",
+            dest="baseline",
+            help="JSON results of an earlier run to compare against"
+        ),
+        optparse.make_option(
+            "--threshold",
+            dest="threshold",
+            type="float",
+            default=0.25,
+            help="how much slower than the baseline (as a fraction) a "
+                 "benchmark may be"
+        ),
+        optparse.make_option(
+            "--noinput",
+            action="store_false",
+            dest="interactive",
+            default=True,
+            help="don't ask before replacing an existing test database"
+        ),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            scales = [int(s) for s in options["scales"].split(",")]
+        except ValueError:
+            raise CommandError("--scales must be numbers, separated by commas")
+
+        # Set up like the test runner, so the real database is left alone
+        # and the test client's requests are allowed.
+        verbosity = int(options["verbosity"])
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(
+            verbosity, autoclobber=not options["interactive"])
+        try:
+            results = run_benchmarks(scales, options["repeat"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity)
+            teardown_test_environment()
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+            regressions = compare(results, baseline, options["threshold"])
+            if regressions:
+                raise CommandError(
+                    "Slower than the baseline:\n" + "\n".join(regressions))
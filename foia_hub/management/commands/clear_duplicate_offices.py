@@ -1,5 +1,9 @@
 from django.core.management.base import BaseCommand
+from foia_hub.api import refresh_documents
+from foia_hub.caching import bump_generation
 from foia_hub.models import Agency, Office
+from foia_hub.replica import use_primary
+from foia_hub.signals import refreshing_later
 
 
 class Command(BaseCommand):
@@ -9,10 +13,20 @@ class Command(BaseCommand):
         Deletes offices that have a sub-agency equivalent.
         """
 
-        agencies = Agency.objects.exclude(
-            parent__isnull=True).values_list("name")
-        offices = Office.objects.values_list("name").all()
-        duplicate_offices = list(set(agencies) & set(offices))
-        for office_name in duplicate_offices:
-            office = Office.objects.get(name=office_name[0])
-            office.delete()
+        with use_primary(), refreshing_later():
+            agencies = Agency.objects.exclude(
+                parent__isnull=True).values_list("name")
+            offices = Office.objects.values_list("name").all()
+            duplicate_offices = list(set(agencies) & set(offices))
+            agency_slugs = set()
+            office_slugs = []
+            for office_name in duplicate_offices:
+                office = Office.objects.get(name=office_name[0])
+                agency_slugs.add(office.agency.slug)
+                office_slugs.append(office.slug)
+                office.delete()
+
+            if office_slugs:
+                refresh_documents(agency_slugs)
+                bump_generation(
+                    agencies=sorted(agency_slugs), offices=office_slugs)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from foia_hub.scripts.export_replica import export_replica
+
+
+class Command(BaseCommand):
+
+    args = "<path>"
+
+    help = """ Exports the contact directory into a self-contained SQLite
+    file, with a full-text search index, for instances to serve reads from.
+        django-admin.py export_replica /path/to/replica.sqlite3
+    An existing file is replaced in one rename, so instances can go on
+    reading it meanwhile. Point FOIA_READ_REPLICA at the file to use it.
+    """
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Give the path of the file to write")
+        export_replica(args[0])
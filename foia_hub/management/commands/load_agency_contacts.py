@@ -1,6 +1,9 @@
 from django.core.management.base import BaseCommand
+from foia_hub.replica import use_primary
 from foia_hub.settings.base import DEFAULT_DATA_REPO
-from foia_hub.scripts.load_agency_contacts import process_yamls
+from foia_hub.scripts.load_agency_contacts import (
+    process_yamls, process_yamls_incrementally)
+import optparse
 import subprocess
 import tempfile
 import os
@@ -13,17 +16,48 @@ class Command(BaseCommand):
         django-admin.py load_agency_contacts
     Or to override the directory:
         django-admin.py load_agency_contacts path/to/data
+    To load everything in one transaction, writing only what has changed:
+        django-admin.py load_agency_contacts --bulk path/to/data
+    To only load files that have changed since they were last loaded:
+        django-admin.py load_agency_contacts --incremental path/to/data
     """
 
+    option_list = BaseCommand.option_list + (
+        optparse.make_option(
+            "--bulk",
+            action="store_true",
+            dest="bulk",
+            default=False,
+            help="parse every file first, then apply only the changes in "
+                 "bulk, inside a single transaction"
+        ),
+        optparse.make_option(
+            "--incremental",
+            action="store_true",
+            dest="incremental",
+            default=False,
+            help="only load files whose contents have changed, and remove "
+                 "the agencies of files that are gone"
+        ),
+    )
+
     def handle(self, *args, **options):
         if len(args) > 0:
             yaml_folder = args[0]
-            process_yamls(yaml_folder)
+            self.load(yaml_folder, options)
         else:
             with tempfile.TemporaryDirectory() as tmpdirname:
                 download_data(tmpdirname)
                 yaml_folder = os.path.join(tmpdirname, 'contacts/data')
-                process_yamls(yaml_folder)
+                self.load(yaml_folder, options)
+
+    def load(self, yaml_folder, options):
+        # What is loaded is compared with the primary database, not a replica
+        with use_primary():
+            if options["incremental"]:
+                process_yamls_incrementally(yaml_folder)
+            else:
+                process_yamls(yaml_folder, bulk=options["bulk"])
 
 
 def download_data(directory):
@@ -0,0 +1,376 @@
+import json
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.handlers.base import BaseHandler
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.middleware import cache
+from django.utils.cache import (
+    cc_delim_re, get_cache_key, get_max_age, has_vary_header,
+    learn_cache_key, patch_cache_control, patch_response_headers)
+from django.utils.http import urlencode
+
+from foia_hub.api import normalize_query
+from foia_hub.caching import get_generation, search_results, start_listener
+from foia_hub.replica import pin_primary
+
+
+logger = logging.getLogger(__name__)
+timing_logger = logging.getLogger('foia_hub.timing')
+search_logger = logging.getLogger('foia_hub.search_queries')
+
+
+# Django's two-part page cache, with the data generation in the key prefix,
+# so that cached pages stop being served as soon as contact data change.
+#
+# Pages matching CACHE_STALE_PATHS are kept for CACHE_STALE_SECONDS past their
+# expiry. An expired page is still served straight away, while it is rendered
+# again in the background (stale-while-revalidate). Each page is cached with
+# its soft expiry, or None if it isn't served stale.
+
+
+# Query parameters that only track where visitors came from, and don't change
+# the page, so are left out of page cache keys
+TRACKING_PARAMETERS_RE = re.compile(
+    r'^(utm_\w+|fbclid|gclid|dclid|mc_cid|mc_eid|_ga)$')
+
+
+def cache_key_path(request):
+    """ The path and query string that `request` is cached under. Tracking
+    parameters are dropped, the rest sorted, and search queries normalized,
+    so that equivalent requests share one cache entry. A search that
+    normalizes to nothing (such as `!`) keeps its own entry, apart from the
+    unfiltered list. """
+
+    params = []
+    for name, values in request.GET.lists():
+        if TRACKING_PARAMETERS_RE.match(name):
+            continue
+        for value in values:
+            if name == 'query':
+                value = normalize_query(value) or value
+            params.append((name, value))
+    if not params:
+        return request.path
+    return '%s?%s' % (request.path, urlencode(sorted(params)))
+
+
+class CacheKeyRequest(object):
+    """ Stands in for a request when page cache keys are made, so that
+    they're made from its `cache_key_path`. """
+
+    def __init__(self, request):
+        self._request = request
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+    def build_absolute_uri(self, location=None):
+        return self._request.build_absolute_uri(
+            location or cache_key_path(self._request))
+
+
+def serves_stale(request):
+    return any(
+        re.match(pattern, request.path)
+        for pattern in settings.CACHE_STALE_PATHS)
+
+
+_refresh_handler = None
+
+
+def copy_response(response):
+    """ A copy of a cached page's `response`, for one request to send.
+    Cached values are shared by every request a worker serves from memory
+    (see foia_hub.cache_backends), and Django changes a response as it sends
+    it. Only plain, non-streaming responses are cached. """
+
+    copied = HttpResponse(
+        response.content, status=response.status_code,
+        reason=response.reason_phrase)
+    for header, value in response.items():
+        copied[header] = value
+    copied.cookies.update(response.cookies)
+    return copied
+
+
+def refresh_page(environ, lock_key, page_cache):
+    """ Handles the request `environ` again, skipping the cache lookup, so
+    that the fresh page is cached. Then releases `lock_key`. """
+
+    global _refresh_handler
+    try:
+        if _refresh_handler is None:
+            handler = BaseHandler()
+            handler.load_middleware()
+            _refresh_handler = handler
+        request = WSGIRequest(environ)
+        request._cache_refresh = True
+        _refresh_handler.get_response(request)
+    except Exception:
+        logger.exception('Could not refresh %s', environ.get('PATH_INFO'))
+    finally:
+        page_cache.delete(lock_key)
+
+
+def start_refresh(environ, lock_key, page_cache):
+    """ Refreshes a page in a background thread, which is returned. """
+
+    def run():
+        try:
+            refresh_page(environ, lock_key, page_cache)
+        finally:
+            for conn in connections.all():
+                conn.close()
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class UpdateCacheMiddleware(cache.UpdateCacheMiddleware):
+
+    def process_response(self, request, response):
+        """Sets the cache, if needed."""
+        if not self._should_update_cache(request, response):
+            return response
+
+        if response.streaming or response.status_code != 200:
+            return response
+
+        if not request.COOKIES and response.cookies and has_vary_header(response, 'Cookie'):
+            return response
+
+        timeout = get_max_age(response)
+        if timeout is None:
+            timeout = self.cache_timeout
+        elif timeout == 0:
+            return response
+        patch_response_headers(response, timeout)
+        if timeout:
+            soft_expiry = None
+            stored_for = timeout
+            if serves_stale(request):
+                soft_expiry = time.time() + timeout
+                stored_for += settings.CACHE_STALE_SECONDS
+                patch_cache_control(
+                    response,
+                    stale_while_revalidate=settings.CACHE_STALE_SECONDS)
+            cache_key = learn_cache_key(
+                CacheKeyRequest(request), response, stored_for,
+                request._cache_key_prefix, cache=self.cache)
+            if hasattr(response, 'render') and callable(response.render):
+                response.add_post_render_callback(
+                    lambda r: self.cache.set(
+                        cache_key, (soft_expiry, copy_response(r)),
+                        stored_for)
+                )
+            else:
+                self.cache.set(
+                    cache_key, (soft_expiry, copy_response(response)),
+                    stored_for)
+        return response
+
+
+class FetchFromCacheMiddleware(cache.FetchFromCacheMiddleware):
+
+    def process_request(self, request):
+        """
+        Checks whether the page is already cached and returns the cached
+        version if available.
+        """
+        if request.method not in ('GET', 'HEAD'):
+            request._cache_update_cache = False
+            return None  # Don't bother checking the cache.
+
+        key_prefix = '%s.%s' % (self.key_prefix, get_generation())
+        request._cache_key_prefix = key_prefix
+
+        if getattr(request, '_cache_refresh', False):
+            request._cache_update_cache = True
+            return None  # Refreshing a stale page
+
+        key_request = CacheKeyRequest(request)
+        cache_key = get_cache_key(key_request, key_prefix, 'GET', cache=self.cache)
+        if cache_key is None:
+            request._cache_update_cache = True
+            return None  # No cache information available, need to rebuild.
+        entry = self.cache.get(cache_key, None)
+        if entry is None and request.method == 'HEAD':
+            cache_key = get_cache_key(key_request, key_prefix, 'HEAD', cache=self.cache)
+            entry = self.cache.get(cache_key, None)
+
+        if entry is None:
+            request._cache_update_cache = True
+            return None  # No cache information available, need to rebuild.
+
+        soft_expiry, response = entry
+        if soft_expiry is not None and time.time() > soft_expiry:
+            lock_key = cache_key + ':refresh'
+            if self.cache.add(
+                    lock_key, 1, settings.SINGLE_FLIGHT_LOCK_SECONDS):
+                start_refresh(request.environ.copy(), lock_key, self.cache)
+
+        request._cache_update_cache = False
+        return copy_response(response)
+
+
+class PublicPageMiddleware(object):
+    """ Keeps GET and HEAD responses for the public pages in PUBLIC_PATHS
+    free of cookies and of `Vary: Cookie`, so that one cached copy serves
+    everyone, whatever cookies they send. Pages with forms get their CSRF
+    token from the separate, uncached `csrf_token` view instead.
+
+    This should come just after UpdateCacheMiddleware, so that it sees the
+    cookies and Vary headers that the session and CSRF middleware add,
+    before the response is cached. """
+
+    def process_response(self, request, response):
+        if request.method not in ('GET', 'HEAD'):
+            return response
+        if not any(re.match(pattern, request.path)
+                   for pattern in settings.PUBLIC_PATHS):
+            return response
+
+        for name in list(response.cookies):
+            del response.cookies[name]
+        if response.has_header('Vary'):
+            vary = [header for header in cc_delim_re.split(response['Vary'])
+                    if header.lower() != 'cookie']
+            if vary:
+                response['Vary'] = ', '.join(vary)
+            else:
+                del response['Vary']
+        return response
+
+
+# Per-request timing, for a sample of requests.
+
+
+@contextmanager
+def timed(request, name):
+    """ Adds the time spent in the block to the `name` timing of `request`,
+    if the request is being timed. """
+
+    timings = getattr(request, '_timings', None)
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + time.perf_counter() - start
+
+
+class RequestTimingMiddleware(object):
+    """ Times a sample of requests (REQUEST_TIMING_SAMPLE_RATE, from 0 to 1)
+    and counts their queries. The query count, the database, template
+    rendering and total times are sent back in a `Server-Timing` header, and
+    logged as a line of JSON to the `foia_hub.timing` logger.
+
+    Queries are timed by Django's debug cursor, which is only turned on for
+    the requests in the sample. This should come first in
+    MIDDLEWARE_CLASSES, so that it sees the whole request. """
+
+    def process_request(self, request):
+        if random.random() >= settings.REQUEST_TIMING_SAMPLE_RATE:
+            return None
+        request._timings = {}
+        request._timing_start = time.perf_counter()
+        request._timing_queries = len(connection.queries)
+        request._timing_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        return None
+
+    def process_response(self, request, response):
+        if getattr(request, '_timings', None) is None:
+            return response
+
+        total = time.perf_counter() - request._timing_start
+        queries = connection.queries[request._timing_queries:]
+        connection.use_debug_cursor = request._timing_debug_cursor
+        db = sum(float(q['time']) for q in queries)
+        render = request._timings.get('render', 0)
+
+        response['Server-Timing'] = (
+            'db;dur=%.1f;desc="%s queries", render;dur=%.1f, total;dur=%.1f'
+            % (db * 1000, len(queries), render * 1000, total * 1000))
+
+        match = getattr(request, 'resolver_match', None)
+        timing_logger.info(json.dumps({
+            'path': request.path,
+            'view': match.url_name if match else None,
+            'status': response.status_code,
+            'queries': len(queries),
+            'db_ms': round(db * 1000, 1),
+            'render_ms': round(render * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+            'search_cache_hit_ratio': search_results.hit_ratio(),
+        }, sort_keys=True))
+        return response
+
+
+# The searches that are logged, by path (without a trailing slash), and the
+# endpoint they're logged as
+SEARCH_PATHS = {
+    '/agencies': 'agencies',
+    '/api/agency': 'agency',
+    '/api/search': 'search',
+}
+
+
+class SearchQueryLogMiddleware(object):
+    """ Logs each search's endpoint and query, as a line of JSON, to the
+    `foia_hub.search_queries` logger, so that popular searches can be found
+    and cached ahead of time (see `foia_hub.api.prewarm_searches`). Only
+    first pages are logged. This should come before FetchFromCacheMiddleware,
+    so that searches answered from the page cache are counted too. The
+    logger is named after no module, so that no module's own log records
+    end up in the query log. """
+
+    def process_request(self, request):
+        if getattr(request, '_cache_refresh', False):
+            return None
+        endpoint = SEARCH_PATHS.get(request.path.rstrip('/'))
+        query = request.GET.get('query')
+        if endpoint and query and not request.GET.get('cursor'):
+            search_logger.info(json.dumps(
+                {'endpoint': endpoint, 'query': query}, sort_keys=True))
+        return None
+
+
+class PrimaryDatabaseMiddleware(object):
+    """ With a read replica (see foia_hub.replica), reads the primary
+    database for requests that may write what they read: anything but GET
+    and HEAD, and anything under PRIMARY_PATHS, such as the admin. """
+
+    def process_request(self, request):
+        pin_primary(
+            request.method not in ('GET', 'HEAD') or
+            any(re.match(pattern, request.path)
+                for pattern in settings.PRIMARY_PATHS))
+        return None
+
+    def process_response(self, request, response):
+        pin_primary(False)
+        return response
+
+
+class InvalidationListenerMiddleware(object):
+    """ Starts this worker's invalidation listener (see
+    `foia_hub.caching.start_listener`) on its first request, so that each
+    worker forked by gunicorn listens in its own thread. """
+
+    def process_request(self, request):
+        if settings.INVALIDATION_LISTENER:
+            start_listener()
+        return None
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Full-text search over agencies used to rebuild the weighted tsvector for
+# every row on every query. This stores it in a `search_vector` column that a
+# trigger keeps current (so fixtures, bulk loads and admin edits are all
+# covered), and indexes it with GIN. The weighting is frozen here as it was at
+# the time of this migration. Only Postgres has tsearch2, so other backends
+# are left alone.
+
+CREATE_SEARCH_VECTOR = """
+ALTER TABLE foia_hub_agency ADD COLUMN search_vector tsvector;
+
+CREATE FUNCTION foia_hub_agency_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.slug, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.abbreviation, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.description, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(NEW.keywords::text, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER foia_hub_agency_search_vector_trigger
+    BEFORE INSERT OR UPDATE ON foia_hub_agency
+    FOR EACH ROW EXECUTE PROCEDURE foia_hub_agency_search_vector_update();
+
+-- Backfill: touching every row fires the trigger.
+UPDATE foia_hub_agency SET id = id;
+
+CREATE INDEX foia_hub_agency_search_vector_idx
+    ON foia_hub_agency USING gin(search_vector);
+"""
+
+DROP_SEARCH_VECTOR = """
+DROP INDEX IF EXISTS foia_hub_agency_search_vector_idx;
+DROP TRIGGER IF EXISTS foia_hub_agency_search_vector_trigger
+    ON foia_hub_agency;
+DROP FUNCTION IF EXISTS foia_hub_agency_search_vector_update();
+ALTER TABLE foia_hub_agency DROP COLUMN IF EXISTS search_vector;
+"""
+
+
+def add_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_SEARCH_VECTOR)
+
+
+def remove_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_SEARCH_VECTOR)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foia_hub', '0022_auto_20150301_2049'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            add_search_vector,
+            reverse_code=remove_search_vector
+        )
+    ]
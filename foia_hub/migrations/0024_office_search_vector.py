@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Gives offices the same trigger-maintained, GIN-indexed `search_vector` that
+# agencies got in 0023, so that agencies and offices can be searched together
+# in one indexed query. Offices only have a name and a slug; both are weighted
+# like the agency name and slug. `office_slug` is used rather than `slug`, as
+# the full slug repeats the parent agency's name for every office.
+
+CREATE_SEARCH_VECTOR = """
+ALTER TABLE foia_hub_office ADD COLUMN search_vector tsvector;
+
+CREATE FUNCTION foia_hub_office_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.office_slug, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER foia_hub_office_search_vector_trigger
+    BEFORE INSERT OR UPDATE ON foia_hub_office
+    FOR EACH ROW EXECUTE PROCEDURE foia_hub_office_search_vector_update();
+
+-- Backfill: touching every row fires the trigger.
+UPDATE foia_hub_office SET id = id;
+
+CREATE INDEX foia_hub_office_search_vector_idx
+    ON foia_hub_office USING gin(search_vector);
+"""
+
+DROP_SEARCH_VECTOR = """
+DROP INDEX IF EXISTS foia_hub_office_search_vector_idx;
+DROP TRIGGER IF EXISTS foia_hub_office_search_vector_trigger
+    ON foia_hub_office;
+DROP FUNCTION IF EXISTS foia_hub_office_search_vector_update();
+ALTER TABLE foia_hub_office DROP COLUMN IF EXISTS search_vector;
+"""
+
+
+def add_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_SEARCH_VECTOR)
+
+
+def remove_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_SEARCH_VECTOR)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foia_hub', '0023_agency_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            add_search_vector,
+            reverse_code=remove_search_vector
+        )
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import foia_hub.models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foia_hub', '0024_office_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContactFile',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('name', models.CharField(max_length=250, unique=True)),
+                ('sha1', models.CharField(max_length=40)),
+                ('agency_slugs', jsonfield.fields.JSONField(default=foia_hub.models.empty_list)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foia_hub', '0026_datageneration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agency',
+            name='detail_document',
+            field=jsonfield.fields.JSONField(null=True, editable=False, help_text='The detail API response, generated when the contact data are loaded or saved.'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='office',
+            name='detail_document',
+            field=jsonfield.fields.JSONField(null=True, editable=False, help_text='The detail API response, generated when the contact data are loaded or saved.'),
+            preserve_default=True,
+        ),
+    ]
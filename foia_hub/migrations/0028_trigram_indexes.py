@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Trigram indexes for fuzzy search, which is used when a query isn't a valid
+# text search, or finds nothing (a misspelt name, say). The `<%` word
+# similarity operator can use these (pg_trgm 1.2, Postgres 9.6 and up), so
+# fuzzy search doesn't scan the tables.
+
+CREATE_TRIGRAM_INDEXES = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX foia_hub_agency_name_trgm_idx
+    ON foia_hub_agency USING gin(name gin_trgm_ops);
+CREATE INDEX foia_hub_agency_abbreviation_trgm_idx
+    ON foia_hub_agency USING gin(abbreviation gin_trgm_ops);
+CREATE INDEX foia_hub_agency_slug_trgm_idx
+    ON foia_hub_agency USING gin(slug gin_trgm_ops);
+CREATE INDEX foia_hub_office_name_trgm_idx
+    ON foia_hub_office USING gin(name gin_trgm_ops);
+CREATE INDEX foia_hub_office_office_slug_trgm_idx
+    ON foia_hub_office USING gin(office_slug gin_trgm_ops);
+"""
+
+# The extension is left in place, in case anything else has come to use it.
+DROP_TRIGRAM_INDEXES = """
+DROP INDEX IF EXISTS foia_hub_agency_name_trgm_idx;
+DROP INDEX IF EXISTS foia_hub_agency_abbreviation_trgm_idx;
+DROP INDEX IF EXISTS foia_hub_agency_slug_trgm_idx;
+DROP INDEX IF EXISTS foia_hub_office_name_trgm_idx;
+DROP INDEX IF EXISTS foia_hub_office_office_slug_trgm_idx;
+"""
+
+
+def add_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_TRIGRAM_INDEXES)
+
+
+def remove_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_TRIGRAM_INDEXES)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foia_hub', '0027_detail_document'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            add_trigram_indexes,
+            reverse_code=remove_trigram_indexes
+        )
+    ]
@@ -88,6 +88,11 @@ class Contactable(USAddress):
     public_liaison_email = models.EmailField(null=True)
     public_liaison_phone = PhoneNumberField(null=True)
 
+    detail_document = JSONField(
+        null=True, editable=False,
+        help_text='The detail API response, generated when the contact data '
+                  'are loaded or saved.')
+
     class Meta:
         abstract = True
 
@@ -213,6 +218,31 @@ class Stats(models.Model):
             self.agency.name, office_name, self.year, self.stat_type)
 
 
+class ContactFile(models.Model):
+    """ A contact data YAML file, as it was when it was last loaded. The
+    content hash lets incremental loads skip files that haven't changed, and
+    the agency slugs record which agencies the file loaded, so they can be
+    removed along with it. """
+
+    name = models.CharField(max_length=250, unique=True)
+    sha1 = models.CharField(max_length=40)
+    agency_slugs = JSONField(default=empty_list)
+
+    def __str__(self):
+        return '%s %s' % (self.name, self.sha1)
+
+
+class DataGeneration(models.Model):
+    """ A single row counting changes to the contact data. Cached contact
+    data are keyed on the generation, so bumping it invalidates them all at
+    once. See `foia_hub.caching`. """
+
+    generation = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return '%s' % (self.generation,)
+
+
 class Requester(models.Model):
 
     first_name = models.CharField(max_length=250)
@@ -0,0 +1,154 @@
+""" Read replicas: each instance can serve reads from its own SQLite copy of
+the contact directory, exported from the primary database with
+`manage.py export_replica` (see foia_hub.scripts.export_replica), so that
+reads don't cross the network. Set FOIA_READ_REPLICA to the file's path to
+turn this on.
+
+Reads of contact data are routed to the replica by `ReplicaRouter`, and
+searches use its FTS5 index, weighted like the Postgres search. Writes, and
+the reads of requests that may write (see `PrimaryDatabaseMiddleware`), go
+to the primary database. The replica's data generation is the one it was
+exported at, so cached pages follow the replica in use. A new export is
+swapped into place in one rename, and is used from the next connection. """
+
+import threading
+from contextlib import contextmanager
+from json import loads
+
+from django.db import connections
+
+from foia_hub.search import (
+    WEIGHT_A, WEIGHT_B, WEIGHT_C, parse_query, ranked)
+
+
+REPLICA_ALIAS = 'replica'
+
+# The models copied to the replica
+REPLICATED_MODELS = (
+    'agency', 'office', 'stats', 'readingroomurls', 'datageneration')
+
+SEARCH_TABLE = 'foia_hub_search'
+
+# bm25 weights of the search table's columns: kind, record_id, slug, name,
+# abbreviation, description, keywords
+SEARCH_WEIGHTS = ', '.join(str(w) for w in (
+    0, 0, WEIGHT_A, WEIGHT_A, WEIGHT_A, WEIGHT_B, WEIGHT_C))
+
+AGENCY_SEARCH = """
+    SELECT -bm25({table}, {weights}) AS rank, a.id, a.name, a.description,
+        a.abbreviation, a.slug, a.keywords, a.common_requests
+    FROM {table} JOIN foia_hub_agency a ON a.id = {table}.record_id
+    WHERE {table} MATCH %s AND {table}.kind = 'agency'
+""".format(table=SEARCH_TABLE, weights=SEARCH_WEIGHTS)
+
+OFFICE_SEARCH = """
+    SELECT -bm25({table}, {weights}) AS rank, o.name, o.slug,
+        a.name AS agency_name, a.slug AS agency_slug
+    FROM {table}
+        JOIN foia_hub_office o ON o.id = {table}.record_id
+        JOIN foia_hub_agency a ON a.id = o.agency_id
+    WHERE {table} MATCH %s AND {table}.kind = 'office'
+""".format(table=SEARCH_TABLE, weights=SEARCH_WEIGHTS)
+
+
+_pinned = threading.local()
+
+
+@contextmanager
+def use_primary():
+    """ Reads from the primary database inside the block, for work that
+    writes what it reads. """
+
+    pinned = getattr(_pinned, 'primary', False)
+    _pinned.primary = True
+    try:
+        yield
+    finally:
+        _pinned.primary = pinned
+
+
+def pin_primary(pinned):
+    """ Sets whether this thread reads from the primary database. """
+
+    _pinned.primary = pinned
+
+
+class ReplicaRouter(object):
+    """ Routes reads of contact data to the replica, unless the thread has
+    been pinned to the primary database. Everything else is left to the
+    primary database. """
+
+    def db_for_read(self, model, **hints):
+        if getattr(_pinned, 'primary', False):
+            return None
+        if (model._meta.app_label == 'foia_hub' and
+                model._meta.model_name in REPLICATED_MODELS):
+            return REPLICA_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of the primary database
+        return True
+
+    def allow_migrate(self, db, model):
+        return db != REPLICA_ALIAS
+
+
+def match_query(term):
+    """ The FTS5 query for a term from `sanitize_search_term`: its words,
+    stemmed as they were indexed, as prefixes joined by AND and OR. """
+
+    return ' OR '.join(
+        '(%s)' % ' AND '.join('"%s"*' % word for word in group)
+        for group in parse_query(term))
+
+
+def fetch(sql, term):
+    """ The rows of a search of the replica, as dicts. """
+
+    query = match_query(term)
+    if not query:
+        return []
+    cursor = connections[REPLICA_ALIAS].cursor()
+    cursor.execute(sql, [query])
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def agency_matches(term):
+    matches = []
+    for row in fetch(AGENCY_SEARCH, term):
+        for column in ('keywords', 'common_requests'):
+            if row[column]:
+                row[column] = loads(row[column])
+        matches.append((row.pop('rank'), row))
+    return matches
+
+
+def search_agencies(term, key=None, limit=None):
+    """ Agencies matching `term`, as for
+    `foia_hub.api.AgencyResource.search_agencies`. """
+
+    return ranked(agency_matches(term), key, limit, ('id',))
+
+
+def search(term, key=None, limit=None):
+    """ Agencies and offices matching `term`, as for
+    `foia_hub.api.SearchResource.ranked_search`. """
+
+    matches = [(rank, {
+        'is_a': 'agency',
+        'name': a['name'],
+        'slug': a['slug'],
+        'abbreviation': a['abbreviation'],
+        'description': a['description'],
+        'agency_name': None,
+        'agency_slug': None,
+    }) for rank, a in agency_matches(term)]
+    for row in fetch(OFFICE_SEARCH, term):
+        matches.append((row.pop('rank'), dict(
+            row, is_a='office', abbreviation=None, description=None)))
+    return ranked(matches, key, limit, ('name', 'slug'))
@@ -0,0 +1,214 @@
+""" Benchmarks for contact loading, the API and the contact pages, run
+against synthetic contact data at several scales. Each benchmark records
+its time, its number of queries and its peak memory use, so results can be
+saved as JSON and compared against a baseline. """
+
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import yaml
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from foia_hub.models import Agency, ContactFile, Office
+from foia_hub.scripts.load_agency_contacts import (
+    process_yamls, process_yamls_incrementally)
+from foia_hub.signals import refreshing_later
+
+
+DEFAULT_SCALES = (100, 1000, 10000)
+
+# Caching would hide the work being measured.
+NO_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    }
+}
+
+
+def synthetic_agency(i, offices=3):
+    """ Contact data for the `i`th synthetic agency, shaped like a yaml file
+    from the contacts repo, with `offices` offices and a top-level
+    sub-agency. """
+
+    departments = []
+    for j in range(offices + 1):
+        departments.append({
+            'name': 'Office %s of Agency %s' % (j, i),
+            'top_level': j == 0,
+            'abbreviation': 'A%sS' % i if j == 0 else None,
+            'emails': ['foia%s@agency%s.gov' % (j, i)],
+            'phone': '202-555-%04d' % (j % 10000),
+            'address': {
+                'address_lines': ['FOIA Officer'],
+                'street': '%s Main Street' % j,
+                'city': 'Washington',
+                'state': 'DC',
+                'zip': '20001'
+            },
+            'keywords': ['records', 'office %s' % j],
+            'public_liaison': {
+                'name': 'Liaison %s' % j, 'phone': ['202-555-0100']},
+            'service_center': {'name': 'Center %s' % j},
+            'reading_rooms': [
+                ['Reading Room', 'http://agency%s.gov/foia/%s' % (i, j)]],
+            'request_time_stats': {
+                '2014': {'simple_median_days': '%s' % (j + 5),
+                         'complex_median_days': '%s' % (j + 30)}},
+            'request_form': 'http://agency%s.gov/foia/form' % i,
+            'website': 'http://agency%s.gov/foia/' % i,
+        })
+
+    return {
+        'name': 'Agency %s' % i,
+        'abbreviation': 'A%s' % i,
+        'description': 'Agency %s keeps records about topic %s' % (
+            i, i % 50),
+        'keywords': ['topic %s' % (i % 50), 'records'],
+        'common_requests': ['common request'],
+        'no_records_about': ['unrelated records'],
+        'departments': departments,
+    }
+
+
+def write_fixtures(folder, agencies, offices=3):
+    """ Writes a yaml file for each of `agencies` synthetic agencies into
+    `folder`. """
+
+    for i in range(agencies):
+        path = os.path.join(folder, 'A%s.yaml' % i)
+        with open(path, 'w') as f:
+            yaml.dump(synthetic_agency(i, offices), f)
+
+
+def measure(func, repeat=5):
+    """ Runs `func` `repeat` times, and once more while tracing memory.
+    Returns the median and fastest times in seconds, the number of queries
+    of the last timed run and the peak memory in bytes. """
+
+    times = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        # The captured queries are read from the connection's log, which the
+        # next request clears, so they're counted now.
+        query_count = len(queries)
+
+    # Tracing slows everything down, so memory is measured separately.
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'seconds': statistics.median(times),
+        'fastest_seconds': min(times),
+        'queries': query_count,
+        'peak_memory': peak,
+    }
+
+
+def get(client, url):
+    """ A function that requests `url`, and fails unless it is served. """
+
+    def request():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise AssertionError(
+                '%s returned %s' % (url, response.status_code))
+    return request
+
+
+def benchmark_scale(agencies, repeat=5):
+    """ Loads `agencies` synthetic agencies into the database, then runs
+    each benchmark. Returns a dict of benchmark name to measurements. """
+
+    with refreshing_later():
+        Office.objects.all().delete()
+        Agency.objects.all().delete()
+        ContactFile.objects.all().delete()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        write_fixtures(folder, agencies)
+
+        # A first load can only be run once.
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            process_yamls(folder, bulk=True)
+            seconds = time.perf_counter() - start
+        results['load_bulk'] = {
+            'seconds': seconds,
+            'fastest_seconds': seconds,
+            'queries': len(queries),
+        }
+
+        results['reload_bulk'] = measure(
+            lambda: process_yamls(folder, bulk=True), repeat=1)
+        results['reload_incremental'] = measure(
+            lambda: process_yamls_incrementally(folder), repeat=repeat)
+
+    agency = Agency.objects.get(slug='agency-%s' % (agencies // 2))
+    office = agency.office_set.first()
+    client = Client()
+    paths = (
+        ('agency_list', '/api/agency/'),
+        ('agency_search', '/api/agency/?query=records'),
+        ('agency_search_narrow',
+         '/api/agency/?query=%s' % agency.abbreviation),
+        ('search', '/api/search/?query=records'),
+        ('agency_detail', '/api/agency/%s/' % agency.slug),
+        ('office_detail', '/api/office/%s/' % office.slug),
+        ('contact_landing_agency', '/contacts/%s/' % agency.slug),
+        ('contact_landing_office', '/contacts/%s/' % office.slug),
+    )
+    for name, url in paths:
+        results[name] = measure(get(client, url), repeat=repeat)
+
+    return results
+
+
+def run_benchmarks(scales=DEFAULT_SCALES, repeat=5):
+    """ Runs the benchmarks at each scale, with caching turned off. Returns
+    results that can be saved as JSON: the database vendor, and for each
+    scale, the measurements of each benchmark. """
+
+    results = {'vendor': connection.vendor, 'scales': {}}
+    with override_settings(CACHES=NO_CACHES):
+        for agencies in scales:
+            results['scales'][str(agencies)] = benchmark_scale(
+                agencies, repeat)
+    return results
+
+
+def compare(results, baseline, threshold=0.25):
+    """ Compares `results` against `baseline` results. Returns a list of
+    messages about each benchmark that has become more than `threshold`
+    (a fraction) slower, or that makes more queries. Benchmarks missing from
+    either are ignored. """
+
+    regressions = []
+    for scale, benchmarks in sorted(results['scales'].items()):
+        baseline_benchmarks = baseline.get('scales', {}).get(scale, {})
+        for name, result in sorted(benchmarks.items()):
+            before = baseline_benchmarks.get(name)
+            if not before:
+                continue
+            limit = before['seconds'] * (1 + threshold)
+            if result['seconds'] > limit:
+                regressions.append(
+                    '%s at %s agencies: %.4fs, was %.4fs' % (
+                        name, scale, result['seconds'], before['seconds']))
+            if result.get('queries', 0) > before.get('queries', 0):
+                regressions.append(
+                    '%s at %s agencies: %s queries, was %s' % (
+                        name, scale, result['queries'], before['queries']))
+    return regressions
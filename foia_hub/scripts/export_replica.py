@@ -0,0 +1,98 @@
+""" Exports the contact directory from the primary database into a
+self-contained SQLite file, for instances to serve reads from (see
+foia_hub.replica). """
+
+import os
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from foia_hub.models import (
+    Agency, DataGeneration, Office, ReadingRoomUrls, Stats)
+from foia_hub.replica import SEARCH_TABLE
+from foia_hub.search import words
+
+
+EXPORT_ALIAS = 'replica_export'
+
+# In the order they're copied. Content types are copied as they are, so that
+# reading rooms point to the same types in the replica.
+EXPORTED_MODELS = (
+    ContentType, DataGeneration, Agency, Office, Stats, ReadingRoomUrls)
+
+CREATE_SEARCH_TABLE = """
+    CREATE VIRTUAL TABLE {table} USING fts5(
+        kind UNINDEXED, record_id UNINDEXED, slug, name, abbreviation,
+        description, keywords)
+""".format(table=SEARCH_TABLE)
+
+# Agencies and offices are searched on the same columns as in Postgres (see
+# migration 0023), and weighted the same way (see foia_hub.replica)
+SEARCHED_COLUMNS = (
+    ('agency', """
+        SELECT id, slug, name, abbreviation, description, keywords
+        FROM foia_hub_agency
+    """),
+    ('office', """
+        SELECT id, office_slug, name, NULL, NULL, NULL
+        FROM foia_hub_office
+    """),
+)
+
+FILL_SEARCH_TABLE = """
+    INSERT INTO {table} VALUES (%s, %s, %s, %s, %s, %s, %s)
+""".format(table=SEARCH_TABLE)
+
+
+def export_replica(path, using=DEFAULT_DB_ALIAS):
+    """ Writes the contact data in the `using` database, and a search index
+    of it, to a new SQLite database at `path`. The file is written next to
+    `path` first, then renamed over it, so that instances reading the old
+    file never see a partly written one. """
+
+    temporary = '%s.tmp' % path
+    if os.path.exists(temporary):
+        os.remove(temporary)
+
+    connections.databases[EXPORT_ALIAS] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': temporary,
+    }
+    try:
+        try:
+            write_replica(using)
+        finally:
+            connections[EXPORT_ALIAS].close()
+            del connections[EXPORT_ALIAS]
+            del connections.databases[EXPORT_ALIAS]
+    except Exception:
+        os.remove(temporary)
+        raise
+    os.replace(temporary, path)
+
+
+def write_replica(using):
+    """ Creates the tables of the export database, copies the contact data
+    into them, and indexes them for searching. Words are indexed stemmed as
+    by the in-memory index (see foia_hub.search), as FTS5's own stemmer
+    doesn't stem prefix searches. """
+
+    with connections[EXPORT_ALIAS].schema_editor() as editor:
+        for model in EXPORTED_MODELS:
+            editor.create_model(model)
+    for model in EXPORTED_MODELS:
+        model.objects.using(EXPORT_ALIAS).bulk_create(
+            model.objects.using(using).order_by('pk'))
+
+    cursor = connections[EXPORT_ALIAS].cursor()
+    cursor.execute(CREATE_SEARCH_TABLE)
+    for kind, sql in SEARCHED_COLUMNS:
+        cursor.execute(sql)
+        rows = [
+            [kind, row[0]] + [' '.join(words(text)) for text in row[1:]]
+            for row in cursor.fetchall()]
+        cursor.executemany(FILL_SEARCH_TABLE, rows)
+    cursor.execute(
+        "INSERT INTO {table}({table}) VALUES('optimize')".format(
+            table=SEARCH_TABLE))
+    cursor.execute('VACUUM')
@@ -4,11 +4,18 @@ import logging
 import os
 import string
 
-import yaml
 from glob import iglob
 import django
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
 
-from foia_hub.models import Agency, Office, Stats, ReadingRoomUrls
+from foia_hub.api import prewarm_searches, refresh_documents
+from foia_hub.caching import bump_generation
+from foia_hub.models import (
+    Agency, ContactFile, Office, Stats, ReadingRoomUrls)
+from foia_hub.scripts.yaml_parsing import file_hash, parse_yamls
+from foia_hub.signals import refreshing_later
 
 django.setup()
 logger = logging.getLogger(__name__)
@@ -41,6 +48,14 @@ def contactable_fields(agency, office_dict):
     in the office dictionary. This will be called for both parent and child
     agencies/offices (as written in our current data set)"""
 
+    set_contactable_fields(agency, office_dict)
+    update_reading_rooms(agency, office_dict)
+
+
+def set_contactable_fields(agency, office_dict):
+    """ Sets the Contactable and USAddress fields on the agency (or office)
+    without saving anything. """
+
     agency.phone = office_dict.get('phone')
     agency.emails = office_dict.get('emails', [])
     agency.fax = office_dict.get('fax')
@@ -63,7 +78,6 @@ def contactable_fields(agency, office_dict):
     agency.city = address.get('city')
     agency.street = address.get('street')
     agency.address_lines = address.get('address_lines', [])
-    update_reading_rooms(agency, office_dict)
 
 
 def add_request_time_statistics(data, agency, office=None):
@@ -77,6 +91,17 @@ def add_request_time_statistics(data, agency, office=None):
         stats = stats.filter(office__isnull=True)
     stats.delete()
 
+    for stat in request_time_statistics(data):
+        stat.agency = agency
+        stat.office = office
+        stat.save()
+
+
+def request_time_statistics(data):
+    """ Builds unsaved Stats for the latest year of request time stats in
+    `data`. Their agency and office are left for the caller to set. """
+
+    stats = []
     if data.get('request_time_stats'):
         latest_year = sorted(
             data.get('request_time_stats').keys(), reverse=True)[0]
@@ -86,18 +111,15 @@ def add_request_time_statistics(data, agency, office=None):
             for arg in iterator:
                 median = data.get("%s_median_days" % arg[1])
                 if median:
-                    stat = Stats(
-                        agency=agency,
-                        office=office,
-                        year=int(latest_year),
-                        stat_type=arg[0])
+                    stat = Stats(year=int(latest_year), stat_type=arg[0])
 
                     if median == 'less than 1':
                         stat.median = 1
                         stat.less_than_one = True
                     else:
                         stat.median = median
-                    stat.save()
+                    stats.append(stat)
+    return stats
 
 
 def update_reading_rooms(contactable, data):
@@ -189,13 +211,373 @@ def load_data(data):
                 add_request_time_statistics(dept_rec, a, o)
 
 
-def process_yamls(folder):
+class ContactData(object):
+    """ The contact data from a set of yaml files, collected in memory as
+    unsaved Agency, Office, Stats and reading room values keyed by slug.
+    Collecting the same data twice overwrites it, as `load_data` would. """
+
+    def __init__(self):
+        self.agencies = {}
+        self.offices = {}
+        # agency slug -> parent agency slug
+        self.parents = {}
+        # office slug -> agency slug
+        self.office_agencies = {}
+        # (agency slug, office slug or None) -> [Stats]
+        self.stats = {}
+        # (Agency or Office, slug) -> [(link_text, url)]
+        self.reading_rooms = {}
+
+    def agency(self, name):
+        slug = Agency.slug_for(name)
+        if slug not in self.agencies:
+            self.agencies[slug] = Agency(slug=slug, name=name)
+        return self.agencies[slug]
+
+    def office(self, agency, name):
+        office_slug = Office.slug_for(name)
+        slug = agency.slug + '--' + office_slug
+        if slug not in self.offices:
+            self.offices[slug] = Office(slug=slug)
+        office = self.offices[slug]
+        office.office_slug = office_slug
+        office.name = name
+        self.office_agencies[slug] = agency.slug
+        return office
+
+    def contactable(self, contactable, office_dict):
+        set_contactable_fields(contactable, office_dict)
+        key = (type(contactable), contactable.slug)
+        self.reading_rooms[key] = [
+            (link_text, url)
+            for link_text, url in office_dict.get('reading_rooms', [])]
+
+    def statistics(self, data, agency, office=None):
+        key = (agency.slug, office.slug if office else None)
+        self.stats[key] = request_time_statistics(data)
+
+    def collect(self, data):
+        """ Collects the data from one yaml file, following `load_data`.
+        Returns the slugs of the agencies in the file. """
+
+        a = self.agency(data['name'])
+        slugs = [a.slug]
+        load_agency_fields(a, data)
+
+        if len(data['departments']) == 1:
+            self.contactable(a, data['departments'][0])
+        self.statistics(data, a)
+
+        if len(data['departments']) > 1:
+            for dept_rec in data['departments']:
+                if dept_rec.get('top_level'):
+                    sub_agency = self.agency(dept_rec['name'])
+                    slugs.append(sub_agency.slug)
+                    self.parents[sub_agency.slug] = a.slug
+                    load_agency_fields(sub_agency, dept_rec)
+                    self.contactable(sub_agency, dept_rec)
+                    self.statistics(dept_rec, sub_agency)
+                else:
+                    o = self.office(a, dept_rec['name'])
+                    self.contactable(o, dept_rec)
+                    self.statistics(dept_rec, a, o)
+        return slugs
+
+
+def changed_fields(model, current, wanted, exclude=('id',)):
+    """ Returns a dict of the concrete fields whose values differ between the
+    saved `current` object and the unsaved `wanted` object. """
+
+    changes = {}
+    for field in model._meta.concrete_fields:
+        if field.name in exclude:
+            continue
+        value = field.to_python(getattr(wanted, field.attname))
+        if getattr(current, field.attname) != value:
+            changes[field.attname] = value
+    return changes
+
+
+def delete_stale(queryset, wanted):
+    """ Deletes the agencies or offices in `queryset` whose slugs are not
+    among the `wanted` slugs. Child agencies of a deleted agency are kept,
+    without a parent. Returns the number deleted. """
+
+    stale = [
+        pk for slug, pk in queryset.values_list('slug', 'pk')
+        if slug not in wanted]
+    if stale:
+        if queryset.model is Agency:
+            Agency.objects.filter(parent__in=stale).update(parent=None)
+        queryset.model.objects.filter(pk__in=stale).delete()
+    return len(stale)
+
+
+def sync_contactables(
+        queryset, wanted, exclude=('id', 'detail_document')):
+    """ Brings the agencies or offices in `queryset` in line with the
+    `wanted` unsaved objects keyed by slug: new rows are bulk created and
+    only changed rows are updated. Returns the number of rows written. """
+
+    model = queryset.model
+    existing = dict((c.slug, c) for c in queryset.all())
+
+    new = [c for slug, c in wanted.items() if slug not in existing]
+    model.objects.bulk_create(new)
+
+    written = len(new)
+    for slug, current in existing.items():
+        if slug in wanted:
+            changes = changed_fields(model, current, wanted[slug], exclude)
+            if changes:
+                model.objects.filter(pk=current.pk).update(**changes)
+                written += 1
+    return written
+
+
+def sync_stats(queryset, wanted):
+    """ Brings the Stats in `queryset` in line with the `wanted` unsaved
+    Stats, whose agencies and offices have been set. Returns the number of
+    rows written. """
+
+    def key(stat):
+        return (stat.agency_id, stat.office_id, stat.year, stat.stat_type)
+
+    existing = dict((key(s), s) for s in queryset.all())
+    wanted = dict((key(s), s) for s in wanted)
+
+    stale = [s.pk for k, s in existing.items() if k not in wanted]
+    new = [s for k, s in wanted.items() if k not in existing]
+    Stats.objects.filter(pk__in=stale).delete()
+    Stats.objects.bulk_create(new)
+
+    written = len(stale) + len(new)
+    for k, current in existing.items():
+        if k in wanted:
+            changes = changed_fields(Stats, current, wanted[k])
+            if changes:
+                Stats.objects.filter(pk=current.pk).update(**changes)
+                written += 1
+    return written
+
+
+def sync_reading_rooms(queryset, wanted):
+    """ Brings the ReadingRoomUrls in `queryset` in line with `wanted`, a
+    dict of (content type id, object id) to a list of (link_text, url). A
+    contactable's reading rooms are only replaced if they have changed.
+    Returns the number of rows written. """
+
+    existing = {}
+    for rru in queryset.order_by('pk'):
+        existing.setdefault(
+            (rru.content_type_id, rru.object_id), []).append(rru)
+
+    stale, new = [], []
+    for key, rooms in existing.items():
+        if [(r.link_text, r.url) for r in rooms] != wanted.get(key, []):
+            stale.extend(r.pk for r in rooms)
+    for key, rooms in wanted.items():
+        current = [(r.link_text, r.url) for r in existing.get(key, [])]
+        if rooms != current:
+            new.extend(
+                ReadingRoomUrls(
+                    content_type_id=key[0], object_id=key[1],
+                    link_text=link_text, url=url)
+                for link_text, url in rooms)
+
+    ReadingRoomUrls.objects.filter(pk__in=stale).delete()
+    ReadingRoomUrls.objects.bulk_create(new)
+    return len(stale) + len(new)
+
+
+@transaction.atomic
+def bulk_load_data(contact_data, agency_slugs=None):
     """
-    Loops through each agency yaml file and loads it into the database
+    Makes the database match the collected `contact_data`, in a single
+    transaction. Existing rows are compared in memory, so only what has
+    changed is written, and the site never sees a half-loaded database.
+
+    By default every agency and office is in play, and those that are no
+    longer in the data are deleted. Given `agency_slugs`, only those agencies
+    and their offices, stats and reading rooms are touched.
+
+    Returns the number of rows written.
+    """
+
+    agencies = Agency.objects.all()
+    offices = Office.objects.all()
+    stats = Stats.objects.all()
+    if agency_slugs is not None:
+        agencies = agencies.filter(slug__in=agency_slugs)
+        offices = offices.filter(agency__slug__in=agency_slugs)
+        stats = stats.filter(agency__slug__in=agency_slugs)
+
+    # Stale rows go first, so their names and abbreviations can be reused.
+    written = delete_stale(offices, contact_data.offices)
+    written += delete_stale(agencies, contact_data.agencies)
+
+    # Parents are set once every agency has a primary key. A parent outside
+    # of the agencies in play was set by other data, so it is left alone.
+    written += sync_contactables(
+        agencies, contact_data.agencies,
+        exclude=('id', 'detail_document', 'parent'))
+    agency_pks, parent_pks = {}, {}
+    for slug, pk, parent_pk in agencies.values_list(
+            'slug', 'pk', 'parent_id'):
+        agency_pks[slug] = pk
+        parent_pks[slug] = parent_pk
+    in_play = set(agency_pks.values())
+    for slug, pk in agency_pks.items():
+        parent_slug = contact_data.parents.get(slug)
+        if parent_slug:
+            parent_pk = agency_pks[parent_slug]
+        elif parent_pks[slug] in in_play:
+            parent_pk = None
+        else:
+            continue
+        if parent_pks[slug] != parent_pk:
+            Agency.objects.filter(pk=pk).update(parent=parent_pk)
+            written += 1
+
+    for slug, office in contact_data.offices.items():
+        office.agency_id = agency_pks[contact_data.office_agencies[slug]]
+    written += sync_contactables(offices, contact_data.offices)
+    office_pks = dict(offices.values_list('slug', 'pk'))
+
+    wanted_stats = []
+    for (agency_slug, office_slug), agency_stats in contact_data.stats.items():
+        for stat in agency_stats:
+            stat.agency_id = agency_pks[agency_slug]
+            stat.office_id = office_pks[office_slug] if office_slug else None
+            wanted_stats.append(stat)
+    written += sync_stats(stats, wanted_stats)
+
+    agency_type = ContentType.objects.get_for_model(Agency)
+    office_type = ContentType.objects.get_for_model(Office)
+    reading_rooms = ReadingRoomUrls.objects.all()
+    if agency_slugs is not None:
+        reading_rooms = reading_rooms.filter(
+            Q(content_type=agency_type,
+              object_id__in=list(agency_pks.values())) |
+            Q(content_type=office_type,
+              object_id__in=list(office_pks.values())))
+    pks = {
+        Agency: (agency_type.pk, agency_pks),
+        Office: (office_type.pk, office_pks)}
+    wanted_rooms = {}
+    for (model, slug), rooms in contact_data.reading_rooms.items():
+        content_type_pk, model_pks = pks[model]
+        wanted_rooms[(content_type_pk, model_pks[slug])] = rooms
+    written += sync_reading_rooms(reading_rooms, wanted_rooms)
+
+    written += refresh_documents(agency_slugs)
+    return written
+
+
+def yaml_files(folder):
+    """ Maps the name of each agency yaml file in `folder` to its path. """
+
+    return dict(
+        (os.path.basename(path), path)
+        for path in iglob(os.path.join(folder, '*.yaml')))
+
+
+def load_files(files, loaded_files, agency_slugs=None):
+    """ Brings the database up to date with the parsed yaml `files`, a dict
+    of file name to (sha1, data), in one transaction. Files are collected in
+    name order. The ContactFile for each one is recorded, replacing
+    `loaded_files`. If any contact data changed, the data generation is
+    bumped once the transaction is done. See `bulk_load_data` for
+    `agency_slugs`. """
+
+    contact_data = ContactData()
+    contact_files = []
+    for name in sorted(files):
+        sha1, data = files[name]
+        contact_files.append(ContactFile(
+            name=name, sha1=sha1, agency_slugs=contact_data.collect(data)))
+
+    with transaction.atomic(), refreshing_later():
+        written = bulk_load_data(contact_data, agency_slugs)
+        ContactFile.objects.filter(
+            pk__in=[f.pk for f in loaded_files]).delete()
+        ContactFile.objects.bulk_create(contact_files)
+    if written:
+        # Offices only change along with their agency
+        bump_generation(
+            agencies=agency_slugs,
+            offices=None if agency_slugs is None else [])
+        prewarm_searches()
+
+
+def process_yamls_incrementally(folder):
+    """
+    Loads only the agency yaml files in `folder` that have been added or
+    changed since they were last loaded, and deletes the agencies of files
+    that have been removed. Files that share an agency with one of those are
+    reloaded as well, so that agency ends up as a full load would leave it.
+    """
+
+    paths = yaml_files(folder)
+    hashes = dict((name, file_hash(path)) for name, path in paths.items())
+    loaded = dict((f.name, f) for f in ContactFile.objects.all())
+
+    removed = set(loaded) - set(paths)
+    agency_slugs = set()
+    for name in removed:
+        agency_slugs.update(loaded[name].agency_slugs)
+
+    files = {}
+    pending = sorted(
+        name for name in paths
+        if name not in loaded or loaded[name].sha1 != hashes[name])
+    while pending:
+        parsed = parse_yamls([paths[name] for name in pending])
+        for name, data in zip(pending, parsed):
+            files[name] = (hashes[name], data)
+            agency_slugs.update(ContactData().collect(data))
+            if name in loaded:
+                agency_slugs.update(loaded[name].agency_slugs)
+        pending = sorted(
+            name for name in paths
+            if name not in files and name in loaded and
+            agency_slugs.intersection(loaded[name].agency_slugs))
+
+    if files or removed:
+        load_files(
+            files,
+            [loaded[name] for name in loaded
+             if name in files or name in removed],
+            agency_slugs)
+
+
+def process_yamls(folder, bulk=False):
+    """
+    Loops through each agency yaml file and loads it into the database. With
+    `bulk`, every file is parsed first and the database is brought up to date
+    in one transaction, with bulk writes of only what has changed.
+
+    Files are parsed in parallel, and loaded in name order.
     """
-    # Delete all database before loading data
-    Office.objects.all().delete()
-    Agency.objects.all().delete()
-    for item in iglob(os.path.join(folder, '*.yaml')):
-        data = yaml.load(open(item))
-        load_data(data)
+    paths = yaml_files(folder)
+    names = sorted(paths)
+    parsed = parse_yamls([paths[name] for name in names])
+
+    if bulk:
+        files = dict(
+            (name, (file_hash(paths[name]), data))
+            for name, data in zip(names, parsed))
+        load_files(files, ContactFile.objects.all())
+        return
+
+    # Delete all database before loading data. What was loaded is no longer
+    # known, so the next incremental load will load everything.
+    with refreshing_later():
+        ContactFile.objects.all().delete()
+        Office.objects.all().delete()
+        Agency.objects.all().delete()
+        for data in parsed:
+            load_data(data)
+    refresh_documents()
+    bump_generation()
+    prewarm_searches()
@@ -0,0 +1,56 @@
+""" Reading the agency contact yaml files. This module doesn't depend on
+Django, so that worker processes can import it cheaply. """
+
+import hashlib
+import multiprocessing
+
+import yaml
+
+try:
+    # libyaml's loader, if PyYAML was built against it
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+def file_hash(path):
+    """ The SHA-1 hex digest of a file's contents. """
+
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        sha1.update(f.read())
+    return sha1.hexdigest()
+
+
+def parse_yaml(path):
+    """ Parses a yaml file with the safe loader, so tags in the file can't
+    construct arbitrary Python objects. """
+
+    with open(path, 'rb') as f:
+        return yaml.load(f, Loader=SafeLoader)
+
+
+def parse_yamls(paths, processes=None):
+    """ Parses the yaml files at `paths` across a pool of `processes` worker
+    processes (by default, one per CPU). The parsed data are yielded in the
+    same order as `paths`, as soon as each is ready. """
+
+    paths = list(paths)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(paths))
+
+    if processes <= 1:
+        for path in paths:
+            yield parse_yaml(path)
+        return
+
+    # Spawned, rather than forked, workers don't share the parent's
+    # database connection.
+    pool = multiprocessing.get_context('spawn').Pool(processes)
+    try:
+        chunksize = max(1, len(paths) // (processes * 4))
+        for data in pool.imap(parse_yaml, paths, chunksize):
+            yield data
+    finally:
+        pool.terminate()
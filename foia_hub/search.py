@@ -0,0 +1,256 @@
+""" An in-memory search index of agencies and offices, for the `memory`
+SEARCH_BACKEND. The whole corpus is small, so each worker keeps its own
+inverted index, built on first use (or at startup, see `warm_index`) and
+rebuilt when the data generation changes. Searches take the same sanitized
+queries as Postgres full-text search, and are weighted the same way:
+slugs, names and abbreviations first, then descriptions, then keywords. """
+
+import bisect
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+from foia_hub.caching import get_generation
+from foia_hub.models import Agency, Office
+
+
+# Postgres' default ts_rank weights for A, B and C
+WEIGHT_A = 1.0
+WEIGHT_B = 0.4
+WEIGHT_C = 0.2
+
+# Marks matches in headlines, which foia_hub.api turns into HTML
+START_SEL = '\x01'
+STOP_SEL = '\x02'
+
+word_re = re.compile(r'[a-z0-9]+')
+operand_re = re.compile(r'[^\s&|]+')
+
+
+def stem(word):
+    """ A very light stemmer, so that plurals match their singulars. Words
+    and query terms are stemmed the same way, and terms match as prefixes,
+    so it needn't produce real words. """
+
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    if word.endswith(('ches', 'shes', 'sses', 'xes', 'zes')):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith('ss') and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def words(text):
+    return [stem(w) for w in word_re.findall((text or '').lower())]
+
+
+def parse_query(term):
+    """ Parses a term from `sanitize_search_term` into a list of groups of
+    words, where a match needs every word of any one group: `&` binds more
+    tightly than `|`, as in to_tsquery. Stray operators are ignored. """
+
+    groups = []
+    for group in term.split('|'):
+        group_words = []
+        for operand in operand_re.findall(group.replace('&', ' ')):
+            group_words.extend(words(operand.replace(':*', '')))
+        if group_words:
+            groups.append(group_words)
+    return groups
+
+
+class SearchIndex(object):
+    """ An inverted index of `documents`, (record, fields) pairs, where the
+    fields are (text, weight) pairs. Words are kept sorted, so that query
+    terms can match them as prefixes. """
+
+    def __init__(self, documents):
+        self.records = []
+        postings = defaultdict(lambda: defaultdict(float))
+        for i, (record, fields) in enumerate(documents):
+            self.records.append(record)
+            for text, weight in fields:
+                for word in words(text):
+                    postings[word][i] += weight
+        self.words = sorted(postings)
+        self.postings = [dict(postings[w]) for w in self.words]
+
+    def match(self, word):
+        """ The score of each record with a word starting with `word`. A
+        record's best scoring match counts. """
+
+        scores = {}
+        start = bisect.bisect_left(self.words, word)
+        for i in range(start, len(self.words)):
+            if not self.words[i].startswith(word):
+                break
+            for record, score in self.postings[i].items():
+                if score > scores.get(record, 0):
+                    scores[record] = score
+        return scores
+
+    def search(self, term):
+        """ The records matching `term` (from `sanitize_search_term`), as a
+        list of (rank, record) pairs in no particular order. """
+
+        ranks = {}
+        for group in parse_query(term):
+            group_ranks = None
+            for word in group:
+                scores = self.match(word)
+                if group_ranks is None:
+                    group_ranks = scores
+                else:
+                    group_ranks = dict(
+                        (r, group_ranks[r] + s) for r, s in scores.items()
+                        if r in group_ranks)
+                if not group_ranks:
+                    break
+            for record, rank in group_ranks.items():
+                ranks[record] = max(rank, ranks.get(record, 0))
+        return [(rank, self.records[r]) for r, rank in ranks.items()]
+
+
+def agency_fields(agency):
+    return [
+        (agency['slug'], WEIGHT_A),
+        (agency['name'], WEIGHT_A),
+        (agency['abbreviation'], WEIGHT_A),
+        (agency['description'], WEIGHT_B),
+        (' '.join(agency['keywords'] or []), WEIGHT_C),
+    ]
+
+
+def office_fields(office):
+    return [
+        (office['office_slug'], WEIGHT_A),
+        (office['name'], WEIGHT_A),
+    ]
+
+
+class Corpus(object):
+    """ The indexes of agencies, and of agencies and offices together (as
+    search results), for one data generation. """
+
+    def __init__(self, generation):
+        self.generation = generation
+
+        # Instances rather than values(), so JSON fields are decoded
+        fields = (
+            'id', 'name', 'description', 'abbreviation', 'slug', 'keywords',
+            'common_requests')
+        agencies = [
+            dict((f, getattr(a, f)) for f in fields)
+            for a in Agency.objects.only(*fields)]
+        self.agencies = SearchIndex(
+            (a, agency_fields(a)) for a in agencies)
+
+        results = [({
+            'is_a': 'agency',
+            'name': a['name'],
+            'slug': a['slug'],
+            'abbreviation': a['abbreviation'],
+            'description': a['description'],
+            'agency_name': None,
+            'agency_slug': None,
+        }, agency_fields(a)) for a in agencies]
+        offices = Office.objects.values(
+            'name', 'slug', 'office_slug', 'agency__name', 'agency__slug')
+        results.extend(({
+            'is_a': 'office',
+            'name': o['name'],
+            'slug': o['slug'],
+            'abbreviation': None,
+            'description': None,
+            'agency_name': o['agency__name'],
+            'agency_slug': o['agency__slug'],
+        }, office_fields(o)) for o in offices)
+        self.results = SearchIndex(results)
+
+
+_corpus = None
+_corpus_lock = threading.Lock()
+
+
+def get_corpus():
+    """ The index for the current data generation, built if need be. """
+
+    global _corpus
+    generation = get_generation()
+    corpus = _corpus
+    if corpus is None or corpus.generation != generation:
+        with _corpus_lock:
+            if _corpus is None or _corpus.generation != generation:
+                _corpus = Corpus(generation)
+            corpus = _corpus
+    return corpus
+
+
+def reset_index():
+    """ Drops the index, so that the next search rebuilds it. """
+
+    global _corpus
+    _corpus = None
+
+
+def warm_index():
+    """ Builds the index ahead of the first search, if it's being used. """
+
+    if settings.SEARCH_BACKEND == 'memory':
+        get_corpus()
+
+
+def ranked(matches, key, limit, order):
+    """ Up to `limit` + 1 of `matches` ((rank, record) pairs), ordered by
+    rank, highest first, then by the `order` fields, following the sort
+    `key` (as in `foia_hub.api.ranked_page`). The records are returned with
+    their rank, ready to be paginated. """
+
+    def sort_key(match):
+        rank, record = match
+        return [-rank] + [record[f] for f in order]
+
+    matches = sorted(matches, key=sort_key)
+    if key:
+        after = [-key[1]] + key[2:]
+        matches = [m for m in matches if sort_key(m) > after]
+    if limit:
+        matches = matches[:limit + 1]
+    return [dict(record, rank=rank) for rank, record in matches]
+
+
+def search_agencies(term, key=None, limit=None):
+    """ Agencies matching `term`, as for
+    `foia_hub.api.AgencyResource.search_agencies`. """
+
+    return ranked(get_corpus().agencies.search(term), key, limit, ('id',))
+
+
+def search(term, key=None, limit=None):
+    """ Agencies and offices matching `term`, as for
+    `foia_hub.api.SearchResource.ranked_search`. """
+
+    return ranked(
+        get_corpus().results.search(term), key, limit, ('name', 'slug'))
+
+
+def headline(text, term, max_words=35):
+    """ An excerpt of `text` of up to `max_words` words, starting at the
+    first word that matches `term`, with matching words between START_SEL
+    and STOP_SEL, like the headlines of ts_headline. """
+
+    query_words = [w for group in parse_query(term) for w in group]
+
+    def matches(token):
+        return any(
+            w.startswith(q) for w in words(token) for q in query_words)
+
+    tokens = (text or '').split()
+    hits = [i for i, token in enumerate(tokens) if matches(token)]
+    start = min(hits[0], max(len(tokens) - max_words, 0)) if hits else 0
+    return ' '.join(
+        START_SEL + token + STOP_SEL if matches(token) else token
+        for token in tokens[start:start + max_words])
@@ -39,8 +39,13 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'foia_hub.middleware.RequestTimingMiddleware',
+    'foia_hub.middleware.InvalidationListenerMiddleware',
+    'foia_hub.middleware.PrimaryDatabaseMiddleware',
+    'foia_hub.middleware.SearchQueryLogMiddleware',
     'djangosecure.middleware.SecurityMiddleware',
-    'django.middleware.cache.UpdateCacheMiddleware',
+    'foia_hub.middleware.UpdateCacheMiddleware',
+    'foia_hub.middleware.PublicPageMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,13 +53,112 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'django.middleware.cache.FetchFromCacheMiddleware',
+    'foia_hub.middleware.FetchFromCacheMiddleware',
 )
 
 CACHE_MIDDLEWARE_ALIAS = 'default'
 CACHE_MIDDLEWARE_SECONDS = 86400
 CACHE_MIDDLEWARE_KEY_PREFIX = 'openfoia_cache'
 
+# Public pages never set cookies or vary on them, so they can be cached
+# once for everyone. See foia_hub.middleware.PublicPageMiddleware.
+PUBLIC_PATHS = (
+    r'^/$',
+    r'^/contacts/',
+    r'^/agencies/?$',
+    r'^/api/',
+    r'^/request/[-\w]+/$',
+)
+
+# Contact pages, the agencies page and the API are served from the cache for
+# this long after they expire, while they are rendered again in the
+# background. See foia_hub.middleware.
+CACHE_STALE_SECONDS = 60 * 60 * 24 * 7
+CACHE_STALE_PATHS = (
+    r'^/contacts/',
+    r'^/agencies/?$',
+    r'^/api/',
+)
+
+# Cached pages and contact data are keyed on the data generation, which
+# loading contacts or saving in the admin bumps, so they can be kept for a
+# long time. The generation itself is cached for a few seconds.
+DATA_CACHE_SECONDS = 60 * 60 * 24 * 30
+DATA_GENERATION_CACHE_SECONDS = 5
+
+# A missing cached value is computed by one worker at a time, while the rest
+# wait up to SINGLE_FLIGHT_WAIT_SECONDS for it. The lock expires on its own
+# after SINGLE_FLIGHT_LOCK_SECONDS, in case its worker dies.
+SINGLE_FLIGHT_LOCK_SECONDS = 30
+SINGLE_FLIGHT_WAIT_SECONDS = 5
+
+# How long a worker waits to listen for invalidations again, after losing its
+# connection (see foia_hub.caching.listen)
+INVALIDATION_RETRY_SECONDS = 5
+
+# Whether each worker listens for invalidations from other workers and
+# instances, on Postgres (see foia_hub.caching.start_listener)
+INVALIDATION_LISTENER = True
+
+# How agencies and offices are searched: 'database' uses Postgres full-text
+# search (or a plain match on other databases), 'memory' an index kept by
+# each worker and rebuilt when contact data change. See foia_hub.search.
+SEARCH_BACKEND = 'database'
+
+# Whether each worker serves agency and office details, and the agency list,
+# from an in-memory snapshot of the contact directory, rebuilt when contact
+# data change, rather than from the database. See foia_hub.snapshot.
+DATA_SNAPSHOT = False
+
+# With a read replica, requests for these paths read the primary database,
+# as they edit contact data. See foia_hub.replica.
+PRIMARY_PATHS = (
+    r'^/admin/',
+    r'^/update-contacts/',
+)
+
+# The number of search results pages each worker keeps, most recently used
+# first, in front of the shared cache.
+SEARCH_CACHE_SIZE = 500
+
+# Searches are logged here, if set, as lines of JSON. After contact data are
+# loaded, the SEARCH_PREWARM_COUNT most popular are run to fill the cache.
+SEARCH_QUERY_LOG = os.getenv('SEARCH_QUERY_LOG')
+SEARCH_PREWARM_COUNT = 50
+
+# The fraction of requests to time, and count the queries of. See
+# foia_hub.middleware.RequestTimingMiddleware.
+REQUEST_TIMING_SAMPLE_RATE = 0.01
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'level': 'INFO',
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'foia_hub.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
+if SEARCH_QUERY_LOG:
+    LOGGING['handlers']['search_queries'] = {
+        'level': 'INFO',
+        'class': 'logging.FileHandler',
+        'filename': SEARCH_QUERY_LOG,
+    }
+    LOGGING['loggers']['foia_hub.search_queries'] = {
+        'handlers': ['search_queries'],
+        'level': 'INFO',
+        'propagate': False,
+    }
+
 ROOT_URLCONF = 'foia_hub.urls'
 WSGI_APPLICATION = 'foia_hub.wsgi.application'
 
@@ -75,7 +179,8 @@ TEMPLATE_CONTEXT_PROCESSORS = (
     "django.core.context_processors.tz",
     "django.core.context_processors.request",
     "django.contrib.messages.context_processors.messages",
-    "foia_hub.context_processors.google_analytics.google_analytics")
+    "foia_hub.context_processors.google_analytics.google_analytics",
+    "foia_hub.context_processors.typeahead.typeahead")
 
 INSTALLED_APPS += ('django_jinja',)
 DEFAULT_JINJA2_TEMPLATE_EXTENSION = '.html'
@@ -42,9 +42,20 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        'foia_hub.timing': {
+            'handlers': ['file'],
+            'level': 'INFO',
+        },
     },
 }
 
+# Working search without Postgres
+SEARCH_BACKEND = 'memory'
+SEARCH_CACHE_SIZE = 0
+
+# Time every request
+REQUEST_TIMING_SAMPLE_RATE = 1
+
 try:
     from .local_settings import *
 except ImportError:
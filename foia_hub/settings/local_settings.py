@@ -17,3 +17,14 @@ SECRET_KEY = os.getenv("FOIA_SECRET_SESSION_KEY")
 DATABASES = {'default': dj_database_url.parse(database_url)}
 SHOW_WEBFORM = (os.getenv("FOIA_SHOW_WEBFORM") == "true")
 ANALYTICS_ID = os.getenv("FOIA_ANALYTICS_ID")
+
+# Serve reads from a local SQLite copy of the contact directory, made with
+# `manage.py export_replica`. See foia_hub.replica.
+READ_REPLICA = os.getenv("FOIA_READ_REPLICA")
+if READ_REPLICA:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': READ_REPLICA,
+    }
+    DATABASE_ROUTERS = ['foia_hub.replica.ReplicaRouter']
+    SEARCH_BACKEND = 'replica'
@@ -12,8 +12,18 @@ TEMPLATE_DEBUG = False
 # Flag to determine whether the FOIA request form gets shown.
 SHOW_WEBFORM = False
 
+# Each worker keeps recently used values in memory for a minute, in front of
+# the filebased cache that all workers share (see foia_hub.cache_backends)
 CACHES = {
     'default': {
+        'BACKEND': 'foia_hub.cache_backends.TieredCache',
+        'OPTIONS': {
+            'SHARED_CACHE': 'shared',
+            'LOCAL_MAX_ENTRIES': 200,
+            'LOCAL_TIMEOUT': 60,
+        },
+    },
+    'shared': {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
         'LOCATION': os.getenv('TMPDIR', '/tmp'),
         'TIMEOUT': 1440,
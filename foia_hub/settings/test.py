@@ -15,6 +15,15 @@ if custom_backend:
 else:
     ENGINE = "django.db.backends.sqlite3"
 
+# Timing is switched on by the tests that need it
+REQUEST_TIMING_SAMPLE_RATE = 0
+
+# Tests don't need another connection listening for invalidations
+INVALIDATION_LISTENER = False
+
+# Nor do we want search results kept between tests
+SEARCH_CACHE_SIZE = 0
+
 # We don't want to use a cache for testing
 CACHES = {
     'default': {
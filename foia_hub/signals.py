@@ -0,0 +1,76 @@
+""" Keeps the stored detail documents of agencies and offices (see
+foia_hub.api.refresh_documents) up to date however contact data are written,
+and announces each change (see foia_hub.caching.bump_generation). Writers of
+many rows at once, such as the loader, refresh the documents they touched
+themselves, once, inside `refreshing_later`. """
+
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from foia_hub.api import refresh_documents
+from foia_hub.caching import bump_generation
+from foia_hub.models import Agency, Office, ReadingRoomUrls, Stats
+
+
+_deferred = threading.local()
+
+
+@contextmanager
+def refreshing_later():
+    """ Leaves refreshing documents, and bumping the data generation, to
+    the caller inside the block. """
+
+    deferred = getattr(_deferred, 'refresh', False)
+    _deferred.refresh = True
+    try:
+        yield
+    finally:
+        _deferred.refresh = deferred
+
+
+def slugs(model, pks):
+    pks = [pk for pk in pks if pk is not None]
+    return list(model.objects.filter(pk__in=pks).values_list(
+        'slug', flat=True))
+
+
+def changed_contacts(instance):
+    """ The slugs of the agencies whose documents show `instance`, and of
+    the offices it belongs to. """
+
+    if isinstance(instance, Agency):
+        # A deleted agency can't be found from its parent any more
+        return [instance.slug] + slugs(Agency, [instance.parent_id]), []
+    if isinstance(instance, Office):
+        return slugs(Agency, [instance.agency_id]), [instance.slug]
+
+    if isinstance(instance, Stats):
+        agency_pks = [instance.agency_id]
+        office_pks = [instance.office_id]
+    elif instance.content_type.model_class() is Agency:
+        agency_pks = [instance.object_id]
+        office_pks = []
+    else:
+        office_pks = [instance.object_id]
+        agency_pks = Office.objects.filter(pk=instance.object_id).values_list(
+            'agency_id', flat=True)
+    return slugs(Agency, agency_pks), slugs(Office, office_pks)
+
+
+@receiver(post_save, sender=Agency)
+@receiver(post_save, sender=Office)
+@receiver(post_save, sender=Stats)
+@receiver(post_save, sender=ReadingRoomUrls)
+@receiver(post_delete, sender=Agency)
+@receiver(post_delete, sender=Office)
+@receiver(post_delete, sender=Stats)
+@receiver(post_delete, sender=ReadingRoomUrls)
+def contact_data_changed(sender, instance, **kwargs):
+    if getattr(_deferred, 'refresh', False) or kwargs.get('raw'):
+        return
+    agencies, offices = changed_contacts(instance)
+    refresh_documents(agencies)
+    bump_generation(agencies=agencies, offices=offices)
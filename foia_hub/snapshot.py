@@ -0,0 +1,157 @@
+""" An in-memory snapshot of the whole contact directory, for DATA_SNAPSHOT
+mode. The directory is small and read far more often than it changes, so each
+worker keeps all of it: the agency list, the typeahead feed, and the detail
+document of every agency and office (which already hold their latest stats
+and reading rooms). The agency and office endpoints and pages are then served
+without asking the database.
+
+Like the search index (see foia_hub.search), a snapshot is built at startup
+and replaced by a new one when the data generation changes. Snapshots are
+never changed once built, so a request can go on using the one it started
+with while the next one is built. As it is built when the WSGI application
+is loaded, workers forked by gunicorn with `--preload` share the first
+snapshot, copy-on-write. Callers must not change the documents. """
+
+import bisect
+import threading
+
+from django.conf import settings
+from django.http import Http404
+
+from foia_hub.caching import get_generation
+from foia_hub.models import Agency, Office
+
+
+def frozen(values):
+    return tuple(values) if values is not None else None
+
+
+class AgencyRecord(object):
+    """ A read-only agency in the agency list, with the fields that
+    `foia_hub.api.agency_preparer` and the agencies page use. """
+
+    __slots__ = (
+        'id', 'name', 'description', 'abbreviation', 'slug', 'keywords',
+        'common_requests')
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Snapshot records are read-only')
+
+    def __reduce__(self):
+        return (AgencyRecord, tuple(getattr(self, n) for n in self.__slots__))
+
+
+class Snapshot(object):
+    """ The contact directory at one data generation. """
+
+    __slots__ = (
+        'generation', 'agencies', 'agency_keys', 'agency_documents',
+        'office_documents', 'typeahead')
+
+    def __init__(self, generation):
+        # Imported here, as foia_hub.api uses this module
+        from foia_hub.api import (
+            agency_detail_queryset, agency_document, office_detail_queryset,
+            office_document, typeahead_json)
+
+        self.generation = generation
+
+        fields = AgencyRecord.__slots__ + ('detail_document',)
+        agencies = list(Agency.objects.only(*fields))
+        records = [
+            AgencyRecord(
+                a.id, a.name, a.description, a.abbreviation, a.slug,
+                frozen(a.keywords), frozen(a.common_requests))
+            for a in agencies]
+        records.sort(key=lambda a: (a.name, a.id))
+        self.agencies = tuple(records)
+        self.agency_keys = [(a.name, a.id) for a in records]
+        self.typeahead = typeahead_json(
+            (a.name, a.abbreviation, a.slug) for a in records)
+
+        offices = list(Office.objects.only('slug', 'detail_document'))
+        self.agency_documents = documents(
+            agencies, agency_detail_queryset, agency_document)
+        self.office_documents = documents(
+            offices, office_detail_queryset, office_document)
+
+    def agency_page(self, key, limit):
+        """ Up to `limit` + 1 agencies (all of them, by default) in name
+        order, following the sort `key`, [name, id], as for
+        `foia_hub.api.AgencyResource.find_agencies`. """
+
+        start = bisect.bisect_right(self.agency_keys, tuple(key)) if key else 0
+        end = start + limit + 1 if limit else None
+        return self.agencies[start:end]
+
+    def agency_document(self, slug):
+        return self.document(self.agency_documents, slug)
+
+    def office_document(self, slug):
+        return self.document(self.office_documents, slug)
+
+    def document(self, documents, slug):
+        try:
+            return documents[slug]
+        except KeyError:
+            raise Http404('No such agency or office: %s' % slug)
+
+
+def documents(contactables, detail_queryset, build):
+    """ The detail document of each of `contactables`, by slug. Documents
+    that haven't been generated yet are built. """
+
+    by_slug = {}
+    missing = []
+    for contactable in contactables:
+        if contactable.detail_document is None:
+            missing.append(contactable.pk)
+        else:
+            by_slug[contactable.slug] = contactable.detail_document
+    if missing:
+        for contactable in detail_queryset().filter(pk__in=missing):
+            by_slug[contactable.slug] = build(contactable)
+    return by_slug
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot():
+    """ The snapshot for the current data generation. If it has to be built,
+    other requests are served from the previous snapshot meanwhile. """
+
+    global _snapshot
+    generation = get_generation()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.generation == generation:
+        return snapshot
+
+    if not _snapshot_lock.acquire(blocking=snapshot is None):
+        return snapshot  # Someone else is building the new one
+    try:
+        if _snapshot is None or _snapshot.generation != generation:
+            _snapshot = Snapshot(generation)
+        return _snapshot
+    finally:
+        _snapshot_lock.release()
+
+
+def reset_snapshot():
+    """ Drops the snapshot, so that the next request rebuilds it. """
+
+    global _snapshot
+    _snapshot = None
+
+
+def warm_snapshot():
+    """ Builds the snapshot ahead of the first request, if it's being
+    used. """
+
+    if settings.DATA_SNAPSHOT:
+        get_snapshot()
@@ -6,14 +6,18 @@ $(document).ready(function() {
         substrRegex,
         substringMatcher,
         typeahead;
-    //  Set up the agency data source
+    //  Set up the agency data source, from the same versioned feed of
+    //  every agency as the search box
     agencyDatasource = new Bloodhound({
         queryTokenizer: Bloodhound.tokenizers.whitespace,
         limit: 500,
         prefetch: {
-          url: '/api/agency/',
+          url: typeaheadUrl,
+          ttl: 30 * 24 * 60 * 60 * 1000,
           filter: function(response) {
-            return response.objects;
+            return $.map(response.agencies, function(agency) {
+              return {name: agency[0], abbreviation: agency[1], slug: agency[2]};
+            });
           }
         },
         datumTokenizer: function(d) {
@@ -8,12 +8,19 @@ $(document).ready(function() {
       agencyAdaptor,
       footerAdaptor;
 
-  //  Set up the agency data source
+  //  Set up the agency data source, from the same versioned feed of every
+  //  agency as the search box (see search.js)
   agencyDatasource = new Bloodhound({
     queryTokenizer: Bloodhound.tokenizers.whitespace,
     limit: 500, // infinity
-    prefetch: {url: '/api/agency/', filter: function(response) {
-      return response.objects; }},
+    prefetch: {
+      url: typeaheadUrl,
+      filter: function(response) {
+        return $.map(response.agencies, function(agency) {
+          return {name: agency[0], abbreviation: agency[1], slug: agency[2]};
+        });
+      }
+    },
     datumTokenizer: function(d) {
       return []
         .concat(Bloodhound.tokenizers.whitespace(d.name))
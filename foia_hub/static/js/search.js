@@ -15,14 +15,18 @@ $(document).ready(function() {
      // before just going ahead with it, in milliseconds
       gaTimeout = 500;
 
-  //  Set up the agency data source
+  //  Set up the agency data source. The feed's URL changes whenever the
+  //  agencies do, so it is kept in local storage for as long as it lasts.
   agencyDatasource = new Bloodhound({
     queryTokenizer: Bloodhound.tokenizers.whitespace,
     limit: 500, // infinity
     prefetch: {
-      url: '/api/agency/',
+      url: typeaheadUrl,
+      ttl: 30 * 24 * 60 * 60 * 1000,
       filter: function(response) {
-        return response.objects;
+        return $.map(response.agencies, function(agency) {
+          return {name: agency[0], abbreviation: agency[1], slug: agency[2]};
+        });
       }
     },
     datumTokenizer: function(d) {
@@ -31,8 +35,6 @@ $(document).ready(function() {
         .concat(Bloodhound.tokenizers.whitespace(d.abbreviation));
     }
   });
-  // always clear local storage for new requests, at least in dev
-  agencyDatasource.clearPrefetchCache();
   agencyDatasource.initialize();
 
   //  Set up the agency adaptor
@@ -1,13 +1,18 @@
 import json
+from django.contrib.admin import site
+from django.core.management import call_command
 from django.db import connection
 from django.test import TestCase, Client
 from django.utils.unittest import skipIf, skipUnless
 
+from foia_hub.admin import GenericAdmin
 from foia_hub.models import Agency, ReadingRoomUrls, Office
 
 from foia_hub.api import agency_preparer, contact_preparer
 from foia_hub.api import foia_libraries_preparer
-from foia_hub.api import sanitize_search_term, dictfetchall
+from foia_hub.api import sanitize_search_term
+from foia_hub.api import is_valid_tsquery, row_mapper
+from foia_hub.api import refresh_documents, search_text
 from foia_hub.tests import helpers
 
 
@@ -111,6 +116,31 @@ class AgencyAPITests(TestCase):
             'us-patent-and-trademark-office'],
             slugs)
 
+    def test_list_pages(self):
+        """ Agencies are listed a page at a time, each linking to the next,
+        and bad parameters are rejected. """
+
+        c = Client()
+        response = c.get('/api/agency/?limit=2')
+        content = helpers.json_from(response)
+        self.assertEqual(
+            ['department-of-commerce', 'department-of-homeland-security'],
+            [a['slug'] for a in content['objects']])
+
+        next_url = content['meta']['next']
+        self.assertTrue(next_url.startswith('/api/agency/?'))
+        self.assertIn('limit=2', next_url)
+        content = helpers.json_from(c.get(next_url))
+        self.assertEqual(
+            ['us-patent-and-trademark-office'],
+            [a['slug'] for a in content['objects']])
+        self.assertEqual(None, content['meta']['next'])
+
+        response = c.get('/api/agency/?cursor=nonsense')
+        self.assertEqual(400, response.status_code)
+        response = c.get('/api/agency/?limit=many')
+        self.assertEqual(400, response.status_code)
+
     @skipIf(custom_backend == 'postgresql_psycopg2',
             'Test query in case postgres fails')
     def test_list_query_sqlite3(self):
@@ -257,18 +287,43 @@ class AgencyAPITests(TestCase):
             content['objects'][2]['slug'],
             'department-of-homeland-security')
 
-    def test_dictfetchall(self):
-        """ Test that the raw sql converter works """
+    @skipUnless(custom_backend == 'postgresql_psycopg2',
+                'Only postgres has tsearch2')
+    def test_list_query_search_vector_updates(self):
+        """
+        Test that the stored search vector follows changes to an agency
+        """
+        c = Client()
+        response = c.get('/api/agency/?query=hurricanes')
+        content = helpers.json_from(response)
+        self.assertEqual(len(content['objects']), 0)
 
-        cursor = connection.cursor()
-        cursor.execute("select * from foia_hub_agency;")
-        data = dictfetchall(cursor)
-        self.assertEqual(len(data), 3)
+        agency = Agency.objects.get(slug='department-of-commerce')
+        agency.description = 'Tracks hurricanes'
+        agency.save()
 
-        # Lists rendered as strings in DB are brought back as lists
+        response = c.get('/api/agency/?query=hurricanes')
+        content = helpers.json_from(response)
+        self.assertEqual(len(content['objects']), 1)
         self.assertEqual(
-            data[1].get('keywords'),
-            ['business', 'industry', 'forests', 'petroleum'])
+            content['objects'][0]['slug'], 'department-of-commerce')
+
+    def test_row_mapper(self):
+        """ Rows become dicts of just the selected columns, with JSON
+        decoded """
+
+        cursor = connection.cursor()
+        cursor.execute(
+            "select slug, keywords, common_requests from foia_hub_agency "
+            "order by slug")
+        to_dict = row_mapper(cursor.description)
+        data = [to_dict(row) for row in cursor.fetchall()]
+        self.assertEqual(
+            ['common_requests', 'keywords', 'slug'], sorted(data[0]))
+        self.assertEqual(
+            ['business', 'industry', 'forests', 'petroleum'],
+            data[0]['keywords'])
+        self.assertEqual([], data[0]['common_requests'])
 
     def test_sanitize_search_term(self):
         """
@@ -315,6 +370,57 @@ class AgencyAPITests(TestCase):
             test_term,
             "health:* & life:* & justice:* | Justice:* & Peace:*")
 
+    def test_is_valid_tsquery(self):
+        """ Only words joined by single operators are sent to to_tsquery """
+
+        self.assertTrue(is_valid_tsquery('health:*'))
+        self.assertTrue(is_valid_tsquery('health:* & justice:*'))
+        self.assertTrue(is_valid_tsquery('health:*|justice:*'))
+        self.assertTrue(is_valid_tsquery('health-justice:*'))
+
+        self.assertFalse(is_valid_tsquery(''))
+        self.assertFalse(is_valid_tsquery('|'))
+        self.assertFalse(is_valid_tsquery('& health:*'))
+        self.assertFalse(is_valid_tsquery('health:* |'))
+        self.assertFalse(is_valid_tsquery('health:*||justice:*'))
+        self.assertFalse(is_valid_tsquery('-:* & health:*'))
+        self.assertFalse(is_valid_tsquery(sanitize_search_term('???')))
+
+    def test_search_text(self):
+        """ Searches are run on their normalized form, as plain words """
+
+        self.assertEqual('irs', search_text('I.R.S.'))
+        self.assertEqual('comerce', search_text(' C.o.m.e.r.c.e '))
+        self.assertEqual(
+            'tax trade OR patent', search_text('Tax AND Trade OR Patent'))
+        self.assertEqual('', search_text('!'))
+        self.assertEqual(None, search_text(''))
+        self.assertEqual(None, search_text(None))
+
+    @skipUnless(custom_backend == 'postgresql_psycopg2',
+                'Only postgres has pg_trgm')
+    def test_list_query_fuzzy(self):
+        """
+        Misspelt names, and queries that aren't valid text searches, find
+        similar agencies instead
+        """
+        c = Client()
+        response = c.get('/api/agency/?query=comerce')
+        content = helpers.json_from(response)
+        self.assertEqual(
+            content['objects'][0]['slug'], 'department-of-commerce')
+
+        response = c.get('/api/agency/?query=%26+homland+security')
+        self.assertEqual(response.status_code, 200)
+        content = helpers.json_from(response)
+        self.assertEqual(
+            content['objects'][0]['slug'],
+            'department-of-homeland-security')
+
+        response = c.get('/api/agency/?query=%3F%3F%3F')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(helpers.json_from(response)['objects'], [])
+
     def test_detail(self):
         """ Check the detail view for an agency."""
 
@@ -348,6 +454,63 @@ class AgencyAPITests(TestCase):
             content['offices'][1]['slug'],
             'us-patent-and-trademark-office')
 
+    def test_detail_query_count(self):
+        """ The detail view for an agency serves its stored document, so it
+        costs the same number of queries however many components the agency
+        has. """
+
+        commerce = Agency.objects.get(slug='department-of-commerce')
+        for i in range(5):
+            Office(agency=commerce, name='Office %s' % i).save()
+            Agency(name='Child Agency %s' % i, parent=commerce).save()
+        refresh_documents([commerce.slug])
+
+        # One query, plus two reads of the data generation (one for the page
+        # cache, one for the API cache) that the dummy cache can't keep.
+        c = Client()
+        with self.assertNumQueries(3):
+            response = c.get('/api/agency/department-of-commerce/')
+        content = helpers.json_from(response)
+        self.assertEqual(12, len(content['offices']))
+
+    def test_detail_document(self):
+        """ Saving or deleting an agency or office, in the admin or
+        anywhere else, regenerates the stored documents it appears in, and
+        agencies without a document yet are served one built on the spot.
+        """
+
+        slug = 'department-of-commerce'
+        self.assertEqual(
+            None, Agency.objects.get(slug=slug).detail_document)
+        c = Client()
+        content = helpers.json_from(c.get('/api/agency/%s/' % slug))
+
+        commerce = Agency.objects.get(slug=slug)
+        commerce.save()
+        self.assertEqual(
+            content, Agency.objects.get(slug=slug).detail_document)
+
+        GenericAdmin(Office, site).save_model(
+            None, Office(agency=commerce, name='New Office'), None, False)
+        document = Agency.objects.get(slug=slug).detail_document
+        self.assertEqual(
+            len(content['offices']) + 1, len(document['offices']))
+        office = Office.objects.get(slug='%s--new-office' % slug)
+        self.assertEqual(slug, office.detail_document['agency_slug'])
+
+        office.delete()
+        self.assertEqual(
+            content, Agency.objects.get(slug=slug).detail_document)
+
+        Office(agency=commerce, name='U.S. Patent and Trademark Office').save()
+        call_command('clear_duplicate_offices')
+        self.assertEqual(
+            content, Agency.objects.get(slug=slug).detail_document)
+
+        refresh_documents()
+        self.assertFalse(Agency.objects.filter(detail_document=None).exists())
+        self.assertFalse(Office.objects.filter(detail_document=None).exists())
+
     def test_reading_rooms(self):
         c = Client()
         response = c.get('/api/agency/department-of-commerce/')
@@ -382,6 +545,19 @@ class OfficeAPITests(TestCase):
         self.assertEqual(12.2, content['complex_processing_time'])
         self.assertEqual(None, content['simple_processing_time'])
 
+    def test_detail_query_count(self):
+        """ The detail view for an office serves its stored document. """
+
+        refresh_documents()
+
+        # One query, plus two reads of the data generation.
+        c = Client()
+        with self.assertNumQueries(3):
+            response = c.get(
+                '/api/office/department-of-commerce--census-bureau/')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('Census Bureau', helpers.json_from(response)['name'])
+
     def test_reading_room(self):
         """ Check that the detail view for an agency has the reading room
         links"""
@@ -395,3 +571,75 @@ class OfficeAPITests(TestCase):
             'link_text': 'The Electronic Reading Room',
             'url': 'http://www.usmint.gov/FOIA/?action=room'}],
             content['foia_libraries'])
+
+
+class SearchAPITests(TestCase):
+    fixtures = ['agencies_test.json', 'offices_test.json']
+
+    def test_list_no_query(self):
+        """ Without a query there is nothing to search for. """
+
+        c = Client()
+        response = c.get('/api/search/')
+        self.assertEqual(200, response.status_code)
+        content = helpers.json_from(response)
+        self.assertEqual([], content['objects'])
+
+    @skipIf(custom_backend == 'postgresql_psycopg2',
+            'Test query in case postgres fails')
+    def test_list_query_sqlite3(self):
+        """ Offices are found alongside agencies, and say what they are. """
+
+        c = Client()
+        response = c.get('/api/search/?query=census')
+        self.assertEqual(200, response.status_code)
+        content = helpers.json_from(response)
+        self.assertEqual(len(content['objects']), 1)
+        result = content['objects'][0]
+        self.assertEqual('office', result['is_a'])
+        self.assertEqual('department-of-commerce--census-bureau', result['slug'])
+        self.assertEqual('department-of-commerce', result['agency_slug'])
+
+        response = c.get('/api/search/?query=commerce')
+        content = helpers.json_from(response)
+        self.assertEqual(len(content['objects']), 1)
+        self.assertEqual('agency', content['objects'][0]['is_a'])
+        self.assertEqual(
+            'department-of-commerce', content['objects'][0]['slug'])
+
+    def test_list_pages(self):
+        """ Search results are returned a page at a time. """
+
+        c = Client()
+        url = '/api/search/?query=department&limit=1'
+        slugs = []
+        while url:
+            content = helpers.json_from(c.get(url))
+            self.assertTrue(len(content['objects']) <= 1)
+            slugs.extend(r['slug'] for r in content['objects'])
+            url = content['meta']['next']
+
+        content = helpers.json_from(c.get('/api/search/?query=department'))
+        self.assertEqual([r['slug'] for r in content['objects']], slugs)
+        self.assertTrue(len(slugs) > 1)
+
+    @skipUnless(custom_backend == 'postgresql_psycopg2',
+                'Only postgres has tsearch2')
+    def test_list_query_postgres(self):
+        """ Agencies and offices are ranked together. """
+
+        c = Client()
+        response = c.get('/api/search/?query=emergency')
+        self.assertEqual(200, response.status_code)
+        content = helpers.json_from(response)
+        self.assertEqual(len(content['objects']), 2)
+
+        # The office has `emergency` in its name, DHS only in its description
+        self.assertEqual('office', content['objects'][0]['is_a'])
+        self.assertEqual(
+            'department-of-homeland-security--federal-emergency-management-agency',
+            content['objects'][0]['slug'])
+        self.assertEqual('agency', content['objects'][1]['is_a'])
+        self.assertEqual(
+            'department-of-homeland-security',
+            content['objects'][1]['slug'])
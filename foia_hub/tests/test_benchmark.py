@@ -0,0 +1,47 @@
+from django.test import TestCase
+
+from foia_hub.models import Agency, Office
+from foia_hub.scripts.benchmark import compare, run_benchmarks
+
+
+class BenchmarkTest(TestCase):
+
+    def test_run_benchmarks(self):
+        """ Synthetic agencies are loaded, and every benchmark is measured
+        at every scale. """
+
+        results = run_benchmarks([3, 4], repeat=1)
+        self.assertEqual(['3', '4'], sorted(results['scales']))
+        self.assertEqual(8, Agency.objects.count())
+        self.assertEqual(12, Office.objects.count())
+
+        benchmarks = results['scales']['4']
+        for name in ('load_bulk', 'reload_incremental', 'agency_list',
+                     'agency_detail', 'office_detail', 'search',
+                     'contact_landing_agency'):
+            self.assertIn('seconds', benchmarks[name])
+        self.assertEqual(1, benchmarks['reload_incremental']['queries'])
+        self.assertTrue(benchmarks['agency_detail']['peak_memory'] > 0)
+
+    def test_compare(self):
+        """ Benchmarks that got slower by more than the threshold, or make
+        more queries, are reported. """
+
+        baseline = {'scales': {'100': {
+            'agency_detail': {'seconds': 0.010, 'queries': 3},
+            'agency_list': {'seconds': 0.100, 'queries': 3},
+            'search': {'seconds': 0.100, 'queries': 6},
+        }}}
+        results = {'scales': {'100': {
+            'agency_detail': {'seconds': 0.012, 'queries': 4},
+            'agency_list': {'seconds': 0.200, 'queries': 3},
+            'search': {'seconds': 0.050, 'queries': 6},
+            'office_detail': {'seconds': 1.0, 'queries': 30},
+        }}}
+
+        regressions = compare(results, baseline, threshold=0.25)
+        self.assertEqual([
+            'agency_detail at 100 agencies: 4 queries, was 3',
+            'agency_list at 100 agencies: 0.2000s, was 0.1000s',
+        ], regressions)
+        self.assertEqual([], compare(results, results))
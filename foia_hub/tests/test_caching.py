@@ -0,0 +1,401 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import Mock, patch
+
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from foia_hub.api import AgencyResource, popular_queries, prewarm_searches
+from foia_hub.caching import (
+    LRUCache, bump_generation, cache_key, cached, get_cache, get_generation,
+    invalidate, search_results)
+from foia_hub.middleware import refresh_page, start_refresh
+from foia_hub.models import Agency, DataGeneration
+from foia_hub.tests import helpers
+
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'foia-hub-tests',
+    }
+}
+
+# A LocMemCache stands in for the shared (filebased or networked) cache
+TIERED_CACHES = {
+    'default': {
+        'BACKEND': 'foia_hub.cache_backends.TieredCache',
+        'LOCATION': 'foia-hub-tests-local',
+        'OPTIONS': {
+            'SHARED_CACHE': 'shared',
+            'LOCAL_MAX_ENTRIES': 2,
+            'LOCAL_TIMEOUT': 60,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'foia-hub-tests-shared',
+    },
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CachingTests(TestCase):
+    fixtures = ['agencies_test.json', 'offices_test.json']
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_generation(self):
+        """ The generation starts at zero and each bump moves it on. """
+
+        self.assertEqual(0, get_generation())
+        bump_generation()
+        self.assertEqual(1, get_generation())
+        bump_generation()
+        self.assertEqual(2, get_generation())
+
+    def test_cache_key(self):
+        """ Keys change with the generation and hash their parts. """
+
+        key = cache_key('search', 'a term with spaces')
+        self.assertNotIn(' ', key)
+        self.assertEqual(key, cache_key('search', 'a term with spaces'))
+        bump_generation()
+        self.assertNotEqual(key, cache_key('search', 'a term with spaces'))
+
+    def test_detail_cached_until_bump(self):
+        """ Agency details are served from the cache until the generation is
+        bumped. """
+
+        slug = 'department-of-homeland-security'
+        url = '/api/agency/%s/' % slug
+        c = Client()
+        response = c.get(url)
+        self.assertEqual(
+            'Department of Homeland Security',
+            json.loads(response.content.decode('utf-8'))['name'])
+
+        Agency.objects.filter(slug=slug).update(name='Renamed')
+        with self.assertNumQueries(0):
+            response = c.get(url)
+        self.assertEqual(
+            'Department of Homeland Security',
+            json.loads(response.content.decode('utf-8'))['name'])
+
+        bump_generation()
+        response = c.get(url)
+        self.assertEqual(
+            'Renamed', json.loads(response.content.decode('utf-8'))['name'])
+
+    def test_invalidate(self):
+        """ A notification of changed contact data from another worker or
+        instance makes this one move on to the new generation at once. """
+
+        generation = get_generation()
+        with patch.object(search_results, 'size', 10):
+            search_results.set('results', [1])
+        DataGeneration.objects.update_or_create(
+            pk=1, defaults={'generation': generation + 1})
+        self.assertEqual(generation, get_generation())
+
+        message = invalidate(
+            '{"agencies": ["department-of-commerce"], "offices": []}')
+        self.assertEqual(['department-of-commerce'], message['agencies'])
+        self.assertEqual(generation + 1, get_generation())
+        self.assertEqual(None, search_results.get('results'))
+
+    @override_settings(INVALIDATION_LISTENER=True)
+    def test_listener_started_per_worker(self):
+        """ Each worker process starts its own invalidation listener, on its
+        first request, as forked workers don't inherit the thread. """
+
+        with patch('foia_hub.caching.connection') as connection, \
+                patch('foia_hub.caching.threading.Thread') as thread, \
+                patch('foia_hub.caching.os.getpid') as getpid, \
+                patch('foia_hub.caching._listener', None), \
+                patch('foia_hub.caching._listener_pid', None):
+            connection.vendor = 'postgresql'
+            getpid.return_value = 100
+            c = Client()
+            c.get('/api/agency/')
+            c.get('/api/agency/')
+            self.assertEqual(1, thread.return_value.start.call_count)
+
+            getpid.return_value = 101
+            c.get('/api/agency/')
+            self.assertEqual(2, thread.return_value.start.call_count)
+
+    def test_lru_cache(self):
+        """ The least recently used values are evicted, and hits and misses
+        are counted. """
+
+        lru = LRUCache(2)
+        self.assertEqual(None, lru.hit_ratio())
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(1, lru.get('a'))
+        lru.set('c', 3)
+        self.assertEqual(None, lru.get('b'))
+        self.assertEqual(1, lru.get('a'))
+        self.assertEqual(3, lru.get('c'))
+        self.assertEqual(0.75, lru.hit_ratio())
+
+    def test_search_results_kept_by_worker(self):
+        """ Searches differing only in case and spacing share results, which
+        each worker keeps in front of the shared cache. """
+
+        resource = AgencyResource()
+        with patch.object(search_results, 'size', 10):
+            search_results.clear()
+            first = resource.all_agencies('Commerce')
+            with self.assertNumQueries(0):
+                self.assertEqual(first, resource.all_agencies(' commerce'))
+            self.assertEqual(1, search_results.hits)
+            search_results.clear()
+
+    def write_query_log(self, entries):
+        handle, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'w') as log:
+            for entry in entries:
+                log.write(json.dumps(entry) + '\n')
+            log.write('not json\n')
+        return path
+
+    def test_popular_queries(self):
+        """ Searches are counted by their normalized form, and returned in
+        their most common spelling. """
+
+        path = self.write_query_log(
+            [{'endpoint': 'agency', 'query': 'commerce'}] +
+            [{'endpoint': 'agency', 'query': 'Commerce'}] * 2 +
+            [{'endpoint': 'search', 'query': 'census'}])
+        self.assertEqual(
+            [('agency', 'Commerce'), ('search', 'census')],
+            popular_queries(path, 5))
+        self.assertEqual([('agency', 'Commerce')], popular_queries(path, 1))
+
+    def test_prewarm_searches(self):
+        """ Popular searches are cached before they are asked for. """
+
+        path = self.write_query_log([
+            {'endpoint': 'agency', 'query': 'commerce'},
+            {'endpoint': 'agencies', 'query': 'commerce'},
+            {'endpoint': 'search', 'query': 'census'},
+        ])
+        self.assertEqual(3, prewarm_searches(path))
+        self.assertEqual(0, prewarm_searches(path + '.missing'))
+
+        c = Client()
+        with self.assertNumQueries(0):
+            c.get('/api/agency/?query=commerce')
+            c.get('/api/search/?query=census')
+            AgencyResource().all_agencies('commerce')
+
+    @override_settings(SINGLE_FLIGHT_WAIT_SECONDS=5)
+    def test_single_flight(self):
+        """ While another worker is computing a value, it is waited for
+        rather than computed again. """
+
+        cache = get_cache()
+        cache.add('key:lock', 1, 30)
+        threading.Timer(0.1, lambda: cache.set('key', 'theirs')).start()
+        self.assertEqual('theirs', cached('key', lambda: 'ours'))
+
+    @override_settings(SINGLE_FLIGHT_WAIT_SECONDS=0.2)
+    def test_single_flight_gives_up(self):
+        """ A value that doesn't come in time is computed anyway, leaving
+        the lock to the worker holding it. A worker's own lock is always
+        released. """
+
+        cache = get_cache()
+        cache.add('key:lock', 1, 30)
+        self.assertEqual('ours', cached('key', lambda: 'ours'))
+        self.assertEqual(1, cache.get('key:lock'))
+
+        def fail():
+            raise ValueError
+        self.assertRaises(ValueError, cached, 'other', fail)
+        self.assertEqual(None, cache.get('other:lock'))
+
+    def test_stale_while_revalidate(self):
+        """ An expired page is served at once, and refreshed behind the
+        scenes. """
+
+        slug = 'department-of-commerce'
+        url = '/api/agency/%s/' % slug
+        c = Client()
+        response = c.get(url)
+        self.assertIn('stale-while-revalidate', response['Cache-Control'])
+
+        Agency.objects.filter(slug=slug).update(name='Renamed')
+        get_cache().delete(cache_key('agency-detail', slug))
+
+        later = time.time() + 2 * 86400
+        with patch('foia_hub.middleware.time') as clock, \
+                patch('foia_hub.middleware.start_refresh',
+                      side_effect=refresh_page) as start_refresh:
+            clock.time.return_value = later
+            response = c.get(url)
+            self.assertEqual(
+                'Department of Commerce',
+                json.loads(response.content.decode('utf-8'))['name'])
+            self.assertTrue(start_refresh.called)
+
+            response = c.get(url)
+            self.assertEqual(
+                'Renamed',
+                json.loads(response.content.decode('utf-8'))['name'])
+            self.assertEqual(1, start_refresh.call_count)
+
+    def test_start_refresh(self):
+        """ A stale page is refreshed in a thread, which closes its database
+        connections when it's done. """
+
+        page_cache = get_cache()
+        conn = Mock()
+        with patch('foia_hub.middleware.refresh_page') as refresh, \
+                patch('foia_hub.middleware.connections') as connections:
+            connections.all.return_value = [conn]
+            start_refresh({}, 'page:refresh', page_cache).join()
+        refresh.assert_called_once_with({}, 'page:refresh', page_cache)
+        conn.close.assert_called_once_with()
+
+    def test_equivalent_urls_share_pages(self):
+        """ Tracking parameters, parameter order and the way a search is
+        written don't change which cached page is served. """
+
+        c = Client()
+        response = c.get('/api/agency/?query=Commerce&limit=5&utm_source=x')
+        with self.assertNumQueries(0):
+            for url in ('/api/agency/?limit=5&query=commerce%20',
+                        '/api/agency/?query=COMMERCE&limit=5&gclid=1'):
+                self.assertEqual(response.content, c.get(url).content)
+
+        # A different page size is a different page, which has to be read
+        with CaptureQueriesContext(connection) as queries:
+            c.get('/api/agency/?query=commerce&limit=6')
+        self.assertGreaterEqual(len(queries.captured_queries), 1)
+
+    def test_equivalent_searches_find_the_same(self):
+        """ Searches sharing cached results are run on the same text, so
+        whichever is made first, they find the same agencies. """
+
+        c = Client()
+        for url in ('/api/agency/?query=C.o.m.m.e.r.c.e',
+                    '/api/agency/?query=Commerce'):
+            content = helpers.json_from(c.get(url))
+            self.assertEqual(
+                ['department-of-commerce'],
+                [a['slug'] for a in content['objects']])
+
+        content = helpers.json_from(c.get('/api/search/?query=%21'))
+        self.assertEqual([], content['objects'])
+
+    def test_empty_searches_keep_their_own_pages(self):
+        """ A search that normalizes to nothing doesn't share its cached
+        page with the unfiltered list. """
+
+        c = Client()
+        content = helpers.json_from(c.get('/api/agency/?query=%21'))
+        self.assertEqual([], content['objects'])
+        content = helpers.json_from(c.get('/api/agency/?query='))
+        self.assertEqual(3, len(content['objects']))
+
+        self.assertNotContains(
+            c.get('/agencies/?query=!'), 'Department of Commerce')
+        self.assertContains(
+            c.get('/agencies/?query='), 'Department of Commerce')
+
+
+@override_settings(CACHES=TIERED_CACHES)
+class TieredCacheTests(TestCase):
+    fixtures = ['agencies_test.json', 'offices_test.json']
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_kept_locally(self):
+        """ Values read or written through the tiered cache are then served
+        from memory, without asking the shared cache. """
+
+        tiered, shared = caches['default'], caches['shared']
+        tiered.set('a', {'name': 'A'})
+        shared.set('b', 'B')
+        self.assertEqual('B', tiered.get('b'))
+        shared.clear()
+
+        value = tiered.get('a')
+        self.assertEqual({'name': 'A'}, value)
+        self.assertIs(value, tiered.get('a'))
+        self.assertEqual('B', tiered.get('b'))
+
+        tiered.delete('a')
+        self.assertEqual(None, tiered.get('a'))
+
+    def test_local_limits(self):
+        """ Only the most recently used values are kept locally, and only
+        for LOCAL_TIMEOUT seconds. """
+
+        tiered, shared = caches['default'], caches['shared']
+        tiered.set('a', 1)
+        tiered.set('b', 2)
+        tiered.get('a')
+        tiered.set('c', 3)
+        shared.clear()
+        self.assertEqual([1, None, 3], [tiered.get(k) for k in 'abc'])
+
+        later = time.time() + 61
+        with patch('foia_hub.cache_backends.time') as clock:
+            clock.time.return_value = later
+            self.assertEqual(None, tiered.get('a'))
+
+    def test_shared_only(self):
+        """ Locks are always checked in the shared cache, and a new data
+        generation drops every local value. """
+
+        tiered, shared = caches['default'], caches['shared']
+        self.assertTrue(tiered.add('page:lock', 1))
+        self.assertFalse(tiered.add('page:lock', 1))
+        shared.delete('page:lock')
+        self.assertEqual(None, tiered.get('page:lock'))
+
+        generation = get_generation()
+        tiered.set('a', 1)
+        shared.delete('a')
+        self.assertEqual(1, tiered.get('a'))
+        bump_generation()
+        self.assertEqual(generation + 1, get_generation())
+        self.assertEqual(None, tiered.get('a'))
+
+    def test_pages_served_from_memory(self):
+        """ Cached pages are served from worker memory, until contact data
+        change. """
+
+        c = Client()
+        url = '/api/agency/department-of-commerce/'
+        c.get(url)
+        caches['shared'].clear()
+        get_generation()
+        with self.assertNumQueries(0):
+            response = c.get(url)
+        self.assertEqual(
+            'Department of Commerce',
+            json.loads(response.content.decode('utf-8'))['name'])
+
+        # Each request is sent its own copy of the page kept in memory
+        response['X-Changed'] = '1'
+        self.assertFalse(c.get(url).has_header('X-Changed'))
+
+        Agency.objects.filter(slug='department-of-commerce').update(
+            name='Renamed')
+        bump_generation()
+        response = c.get(url)
+        self.assertEqual(
+            'Renamed', json.loads(response.content.decode('utf-8'))['name'])
@@ -1,11 +1,16 @@
+import copy
 import glob
+import os
+import tempfile
 
+import yaml
 from django.test import TestCase
-from foia_hub.models import Agency, Office
+from foia_hub.models import Agency, ContactFile, Office, Stats
 from foia_hub.scripts.load_agency_contacts import (
     load_data, update_reading_rooms, add_request_time_statistics,
     extract_tty_phone, extract_non_tty_phone, build_abbreviation,
-    process_yamls)
+    process_yamls, process_yamls_incrementally)
+from foia_hub.scripts.yaml_parsing import parse_yaml, parse_yamls
 from mock import patch
 
 
@@ -345,3 +350,186 @@ class LoadingTest(TestCase):
             slug='department-of-commerce--census-bureau')
         self.assertEqual(agency.count(), 0)
         self.assertEqual(office.count(), 0)
+
+
+class BulkLoadingTest(TestCase):
+
+    fixtures = ['agencies_test.json', 'offices_test.json']
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.agency = copy.deepcopy(example_agency)
+        self.agency['departments'][0]['reading_rooms'] = [
+            ['Reading Room', 'http://www.epa.gov/region9/foia/']]
+        self.agency['departments'][1]['request_time_stats'] = {
+            '2013': {'simple_median_days': '10'},
+            '2014': {'simple_median_days': 'less than 1',
+                     'complex_median_days': '20'}}
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write_yaml(self, data, filename='EPA.yaml'):
+        with open(os.path.join(self.folder.name, filename), 'w') as f:
+            yaml.dump(data, f)
+
+    def test_bulk_load(self):
+        """ A bulk load leaves the same data as loading file by file, and
+        drops the agencies and offices that aren't in the files. """
+
+        self.write_yaml(self.agency)
+        process_yamls(self.folder.name, bulk=True)
+
+        a = Agency.objects.get(slug='environmental-protection-agency')
+        self.assertEqual('The mission of EPA is to protect', a.description)
+        self.assertEqual(['Acid Rain', 'Agriculture'], a.keywords)
+        self.assertEqual(None, a.parent)
+        self.assertEqual(
+            sorted(['region-10-states-ak-id-or-wa',
+                    'environmental-protection-agency-' +
+                    '-region-9-states-az-ca-hi-nv-as-gu']),
+            sorted(o['slug'] for o in a.detail_document['offices']))
+
+        sub_a = Agency.objects.get(slug='region-10-states-ak-id-or-wa')
+        self.assertEqual(a, sub_a.parent)
+        self.assertEqual('R9', sub_a.abbreviation)
+        self.assertEqual('Timbo', sub_a.person_name)
+        self.assertEqual(['line 1', 'line 2'], sub_a.address_lines)
+        stats = sub_a.stats_set.order_by('stat_type')
+        self.assertEqual(
+            [('C', 2014, 20, False), ('S', 2014, 1, True)],
+            [(s.stat_type, s.year, s.median, s.less_than_one)
+             for s in stats])
+
+        o = Office.objects.get(
+            slug='environmental-protection-agency-' +
+            '-region-9-states-az-ca-hi-nv-as-gu')
+        self.assertEqual(a, o.agency)
+        self.assertEqual('region-9-states-az-ca-hi-nv-as-gu', o.office_slug)
+        self.assertEqual('Timbo Two', o.person_name)
+        self.assertEqual(
+            [('Reading Room', 'http://www.epa.gov/region9/foia/')],
+            [(r.link_text, r.url) for r in o.reading_room_urls.all()])
+
+        self.assertEqual(2, Agency.objects.count())
+        self.assertEqual(1, Office.objects.count())
+
+    def test_bulk_reload(self):
+        """ Reloading keeps existing rows, only writes what has changed and
+        removes what is gone. """
+
+        self.write_yaml(self.agency)
+        process_yamls(self.folder.name, bulk=True)
+        a = Agency.objects.get(slug='environmental-protection-agency')
+
+        # Nothing has changed, so nothing is written. The data and the
+        # stored detail documents are still read, to compare.
+        with self.assertNumQueries(23):
+            process_yamls(self.folder.name, bulk=True)
+
+        self.agency['description'] = 'A new mission'
+        del self.agency['departments'][0]
+        self.write_yaml(self.agency)
+        process_yamls(self.folder.name, bulk=True)
+
+        reloaded = Agency.objects.get(slug='environmental-protection-agency')
+        self.assertEqual(a.pk, reloaded.pk)
+        self.assertEqual('A new mission', reloaded.description)
+        self.assertEqual(0, Office.objects.count())
+        # With a single department, its contact details are the agency's.
+        self.assertEqual('Timbo', reloaded.person_name)
+        self.assertEqual(0, Stats.objects.filter(office__isnull=False).count())
+
+    def test_incremental_load(self):
+        """ Only new and changed files are loaded, the agencies of removed
+        files are deleted, and everything else is left alone. """
+
+        other = {
+            'name': 'Other Agency',
+            'description': 'Other mission',
+            'departments': [{'name': 'Other Agency', 'address': {}}]}
+        self.write_yaml(self.agency)
+        self.write_yaml(other, 'OTHER.yaml')
+        process_yamls_incrementally(self.folder.name)
+
+        self.assertEqual(
+            ['EPA.yaml', 'OTHER.yaml'],
+            sorted(ContactFile.objects.values_list('name', flat=True)))
+        self.assertEqual(
+            ['environmental-protection-agency',
+             'region-10-states-ak-id-or-wa'],
+            ContactFile.objects.get(name='EPA.yaml').agency_slugs)
+        # Agencies that didn't come from these files are untouched
+        self.assertTrue(
+            Agency.objects.filter(
+                slug='department-of-homeland-security').exists())
+
+        # Nothing has changed, so nothing is loaded.
+        with self.assertNumQueries(1):
+            process_yamls_incrementally(self.folder.name)
+
+        # Only the changed file is loaded.
+        Agency.objects.filter(slug='other-agency').update(
+            description='Edited')
+        self.agency['description'] = 'A new mission'
+        self.write_yaml(self.agency)
+        with patch('foia_hub.caching.publish_invalidation') as publish:
+            process_yamls_incrementally(self.folder.name)
+        publish.assert_called_once_with(
+            set(['environmental-protection-agency',
+                 'region-10-states-ak-id-or-wa']), [])
+        self.assertEqual(
+            'A new mission',
+            Agency.objects.get(
+                slug='environmental-protection-agency').description)
+        self.assertEqual(
+            'Edited', Agency.objects.get(slug='other-agency').description)
+
+        # Removing a file removes its agencies and offices.
+        os.remove(os.path.join(self.folder.name, 'EPA.yaml'))
+        process_yamls_incrementally(self.folder.name)
+        self.assertFalse(
+            Agency.objects.filter(slug__in=[
+                'environmental-protection-agency',
+                'region-10-states-ak-id-or-wa']).exists())
+        self.assertFalse(
+            Office.objects.filter(
+                agency__slug='environmental-protection-agency').exists())
+        self.assertTrue(Agency.objects.filter(slug='other-agency').exists())
+        self.assertEqual(
+            ['OTHER.yaml'],
+            list(ContactFile.objects.values_list('name', flat=True)))
+
+
+class YamlParsingTest(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write(self, filename, text):
+        path = os.path.join(self.folder.name, filename)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_parse_yaml_is_safe(self):
+        """ Tags that would construct Python objects are refused. """
+
+        path = self.write(
+            'bad.yaml', "name: !!python/object/apply:os.getcwd []\n")
+        with self.assertRaises(yaml.YAMLError):
+            parse_yaml(path)
+
+    def test_parse_yamls_order(self):
+        """ Files parsed in parallel come back in the order asked for. """
+
+        paths = [
+            self.write('%s.yaml' % i, 'name: Agency %s\n' % i)
+            for i in range(6)]
+        parsed = list(parse_yamls(reversed(paths), processes=2))
+        self.assertEqual(
+            ['Agency %s' % i for i in reversed(range(6))],
+            [data['name'] for data in parsed])
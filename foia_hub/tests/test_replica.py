@@ -0,0 +1,92 @@
+import os
+import tempfile
+
+from django.db import connections
+from django.test import TestCase, Client
+from django.test.utils import override_settings
+
+from foia_hub.models import Agency, FOIARequest, ReadingRoomUrls
+from foia_hub.replica import (
+    REPLICA_ALIAS, ReplicaRouter, match_query, use_primary)
+from foia_hub.scripts.export_replica import export_replica
+from foia_hub.tests import helpers
+
+
+class ReplicaTests(TestCase):
+    fixtures = ['agencies_test.json', 'offices_test.json']
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'replica.sqlite3')
+        export_replica(self.path)
+        connections.databases[REPLICA_ALIAS] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': self.path,
+        }
+
+    def tearDown(self):
+        connections[REPLICA_ALIAS].close()
+        del connections[REPLICA_ALIAS]
+        del connections.databases[REPLICA_ALIAS]
+        self.folder.cleanup()
+
+    def test_export(self):
+        """ The replica holds the contact data, and a new export replaces
+        it in place. """
+
+        replica = Agency.objects.using(REPLICA_ALIAS)
+        self.assertEqual(
+            sorted(Agency.objects.values_list('slug', flat=True)),
+            sorted(replica.values_list('slug', flat=True)))
+        self.assertEqual(
+            sorted(str(r.content_object) for r in ReadingRoomUrls.objects.all()),
+            sorted(str(r.content_object) for r in
+                   ReadingRoomUrls.objects.using(REPLICA_ALIAS).all()))
+
+        Agency.objects.filter(slug='department-of-commerce').update(
+            name='Department of Trade')
+        connections[REPLICA_ALIAS].close()
+        export_replica(self.path)
+        self.assertEqual(
+            'Department of Trade',
+            replica.get(slug='department-of-commerce').name)
+        self.assertEqual(['replica.sqlite3'], os.listdir(self.folder.name))
+
+    def test_router(self):
+        """ Contact data are read from the replica, unless the primary
+        database is asked for. """
+
+        router = ReplicaRouter()
+        self.assertEqual(REPLICA_ALIAS, router.db_for_read(Agency))
+        self.assertEqual(None, router.db_for_read(FOIARequest))
+        self.assertEqual(None, router.db_for_write(Agency))
+        with use_primary():
+            self.assertEqual(None, router.db_for_read(Agency))
+        self.assertFalse(router.allow_migrate(REPLICA_ALIAS, Agency))
+
+    @override_settings(SEARCH_BACKEND='replica')
+    def test_search(self):
+        """ Searches of the replica's FTS5 index find what the other
+        search backends do. """
+
+        self.assertEqual(
+            '("health"* AND "life"*) OR ("justice"*)',
+            match_query('health:* & life:* | justice:*'))
+        self.assertEqual('', match_query('& |'))
+
+        c = Client()
+        content = helpers.json_from(c.get('/api/agency/?query=emergen'))
+        self.assertEqual(
+            ['department-of-homeland-security'],
+            [a['slug'] for a in content['objects']])
+
+        content = helpers.json_from(c.get('/api/search/?query=census'))
+        self.assertEqual(
+            [('office', 'department-of-commerce--census-bureau')],
+            [(r['is_a'], r['slug']) for r in content['objects']])
+
+        content = helpers.json_from(
+            c.get('/api/search/?query=department&limit=1'))
+        self.assertEqual(1, len(content['objects']))
+        content = helpers.json_from(c.get(content['meta']['next']))
+        self.assertEqual(1, len(content['objects']))
@@ -41,6 +41,27 @@ class FOIARequestTests(TestCase):
             '/api/request/', content_type="application/json", data=data_string)
         self.assertEqual(201, response.status_code)
 
+    def test_list_pages(self):
+        """ Requests are listed a page at a time, never all at once. """
+
+        requester = Requester.objects.create(
+            first_name='Joe', last_name='Public', email='joe@public.com')
+        requests = [
+            FOIARequest.objects.create(
+                requester=requester, agency=self.agency,
+                request_body='Request %s' % i)
+            for i in range(3)]
+
+        c = Client()
+        content = helpers.json_from(c.get('/api/request/?limit=2'))
+        self.assertEqual(
+            [r.pk for r in requests[:2]],
+            [r['tracking_id'] for r in content['objects']])
+        content = helpers.json_from(c.get(content['meta']['next']))
+        self.assertEqual(
+            [requests[2].pk], [r['tracking_id'] for r in content['objects']])
+        self.assertEqual(None, content['meta']['next'])
+
     def test_create_request_no_email(self):
         """ Try to submit a request to an agency that has no online form, and
         no email address. This should fail with the appropriate HTTP status
@@ -0,0 +1,127 @@
+from django.test import TestCase, Client
+from django.test.utils import override_settings
+
+from foia_hub.api import add_highlights
+from foia_hub.caching import bump_generation
+from foia_hub.models import Agency
+from foia_hub.search import (
+    START_SEL, STOP_SEL, headline, parse_query, reset_index, search_agencies)
+from foia_hub.tests import helpers
+from foia_hub.tests.test_caching import LOCMEM_CACHES
+
+
+@override_settings(SEARCH_BACKEND='memory', CACHES=LOCMEM_CACHES)
+class MemorySearchTests(TestCase):
+    fixtures = ['agencies_test.json', 'offices_test.json']
+
+    def setUp(self):
+        from django.core.cache import caches
+        caches['default'].clear()
+        reset_index()
+
+    def test_parse_query(self):
+        """ `&` binds more tightly than `|`, and stray operators are
+        dropped. """
+
+        self.assertEqual(
+            [['health', 'life'], ['justice']],
+            parse_query('health:* & life:* | justice:*'))
+        self.assertEqual([['tax']], parse_query('& taxes:*'))
+        self.assertEqual([], parse_query(''))
+
+    def test_list_query(self):
+        """ Words match as prefixes, and combine with AND and OR. """
+
+        c = Client()
+        content = helpers.json_from(c.get('/api/agency/?query=emergen'))
+        self.assertEqual(
+            ['department-of-homeland-security'],
+            [a['slug'] for a in content['objects']])
+
+        content = helpers.json_from(
+            c.get('/api/agency/?query=vital+AND+homeland'))
+        self.assertEqual(
+            ['department-of-homeland-security'],
+            [a['slug'] for a in content['objects']])
+
+        content = helpers.json_from(
+            c.get('/api/agency/?query=patents+OR+technological'))
+        self.assertEqual(2, len(content['objects']))
+
+    def test_list_query_weighting(self):
+        """ Matches in names come before matches in keywords. """
+
+        content = helpers.json_from(
+            Client().get('/api/agency/?query=trademark'))
+        slugs = [a['slug'] for a in content['objects']]
+        self.assertEqual(3, len(slugs))
+        self.assertEqual('us-patent-and-trademark-office', slugs[0])
+        self.assertEqual('department-of-homeland-security', slugs[2])
+
+    def test_search(self):
+        """ Offices are ranked alongside agencies, and paged through. """
+
+        c = Client()
+        content = helpers.json_from(c.get('/api/search/?query=emergency'))
+        self.assertEqual(
+            ['office', 'agency'], [r['is_a'] for r in content['objects']])
+        self.assertEqual(
+            'department-of-homeland-security--federal-emergency-management-agency',
+            content['objects'][0]['slug'])
+
+        url = '/api/search/?query=department&limit=1'
+        slugs = []
+        while url:
+            content = helpers.json_from(c.get(url))
+            slugs.extend(r['slug'] for r in content['objects'])
+            url = content['meta']['next']
+        content = helpers.json_from(c.get('/api/search/?query=department'))
+        self.assertEqual([r['slug'] for r in content['objects']], slugs)
+
+    def test_headline(self):
+        """ Headlines start at the first match, and mark every match. """
+
+        text = ' '.join(['word%s' % i for i in range(50)] + ['Taxes.'])
+        self.assertEqual(
+            ' '.join(['word%s' % i for i in range(16, 50)]) +
+            ' %sTaxes.%s' % (START_SEL, STOP_SEL),
+            headline(text, 'tax:*'))
+        self.assertEqual(
+            '%sA%s <b>' % (START_SEL, STOP_SEL), headline('A <b>', 'a:*'))
+
+        rows = add_highlights([{'headline': headline('A <b>', 'a:*')}])
+        self.assertEqual('A <b>', rows[0]['snippet'])
+        self.assertEqual('<mark>A</mark> &lt;b&gt;', rows[0]['highlight'])
+
+    def test_highlights(self):
+        """ Search results say where they matched. """
+
+        c = Client()
+        content = helpers.json_from(c.get('/api/agency/?query=vital'))
+        result = content['objects'][0]
+        self.assertTrue(
+            result['snippet'].startswith('vital mission: to secure'))
+        self.assertIn('<mark>vital</mark> mission', result['highlight'])
+
+        content = helpers.json_from(c.get('/api/search/?query=census'))
+        self.assertEqual(
+            '<mark>Census</mark> Bureau',
+            content['objects'][0]['highlight'])
+
+        response = c.get('/agencies/?query=vital')
+        self.assertContains(response, '<mark>vital</mark> mission')
+
+    def test_rebuilt_for_new_generation(self):
+        """ The index follows contact data from one generation to the
+        next. """
+
+        self.assertEqual([], search_agencies('hurricane:*'))
+
+        Agency.objects.filter(slug='department-of-commerce').update(
+            description='Tracks hurricanes')
+        self.assertEqual([], search_agencies('hurricane:*'))
+
+        bump_generation()
+        self.assertEqual(
+            ['department-of-commerce'],
+            [a['slug'] for a in search_agencies('hurricane:*')])
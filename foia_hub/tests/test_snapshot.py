@@ -0,0 +1,99 @@
+from django.core.cache import caches
+from django.test import TestCase, Client
+from django.test.utils import override_settings
+
+from foia_hub.api import (
+    agency_detail_queryset, agency_document, office_detail_queryset,
+    office_document, typeahead_feed)
+from foia_hub.caching import bump_generation
+from foia_hub.models import Agency
+from foia_hub.snapshot import get_snapshot, reset_snapshot
+from foia_hub.tests import helpers
+from foia_hub.tests.test_caching import LOCMEM_CACHES
+
+
+@override_settings(DATA_SNAPSHOT=True, CACHES=LOCMEM_CACHES)
+class SnapshotTests(TestCase):
+    fixtures = ['agencies_test.json', 'offices_test.json']
+
+    def setUp(self):
+        caches['default'].clear()
+        reset_snapshot()
+
+    def test_served_without_queries(self):
+        """ Once the snapshot is built, agency and office details, the
+        agency list and the agency pages don't ask the database. """
+
+        get_snapshot()
+        c = Client()
+        with self.assertNumQueries(0):
+            content = helpers.json_from(
+                c.get('/api/agency/department-of-commerce/'))
+            self.assertEqual('Department of Commerce', content['name'])
+            self.assertIn(
+                'department-of-commerce--census-bureau',
+                [o['slug'] for o in content['offices']])
+
+            content = helpers.json_from(
+                c.get('/api/office/department-of-commerce--census-bureau/'))
+            self.assertEqual('Census Bureau', content['name'])
+
+            content = helpers.json_from(c.get('/api/agency/'))
+            self.assertEqual(3, len(content['objects']))
+
+            self.assertContains(
+                c.get('/contacts/department-of-commerce/'), 'Census Bureau')
+            self.assertContains(c.get('/agencies/'), 'Department of Commerce')
+
+        self.assertEqual(404, c.get('/api/agency/nothing/').status_code)
+        self.assertEqual(
+            404, c.get('/api/office/nothing--here/').status_code)
+
+    def test_matches_database(self):
+        """ The snapshot serves what the database would. """
+
+        snapshot = get_snapshot()
+        for agency in agency_detail_queryset():
+            self.assertEqual(
+                agency_document(agency),
+                snapshot.agency_document(agency.slug))
+        for office in office_detail_queryset():
+            self.assertEqual(
+                office_document(office),
+                snapshot.office_document(office.slug))
+
+        c = Client()
+        pages = []
+        url = '/api/agency/?limit=2'
+        while url:
+            content = helpers.json_from(c.get(url))
+            pages.append(content['objects'])
+            url = content['meta']['next']
+        self.assertEqual(
+            [['Department of Commerce', 'Department of Homeland Security'],
+             ['U.S. Patent and Trademark Office']],
+            [[a['name'] for a in page] for page in pages])
+
+        feed = typeahead_feed()
+        with self.settings(DATA_SNAPSHOT=False):
+            self.assertEqual(typeahead_feed(), feed)
+
+    def test_swapped_for_new_generation(self):
+        """ A new snapshot replaces the old one when contact data change,
+        and the old one is left as it was. """
+
+        snapshot = get_snapshot()
+        with self.assertRaises(AttributeError):
+            snapshot.agencies[0].name = 'Changed'
+
+        Agency.objects.filter(slug='department-of-commerce').update(
+            name='Department of Trade')
+        self.assertIs(snapshot, get_snapshot())
+
+        bump_generation()
+        self.assertEqual(
+            'Department of Trade',
+            get_snapshot().agency_document('department-of-commerce')['name'])
+        self.assertEqual(
+            'Department of Commerce',
+            snapshot.agency_document('department-of-commerce')['name'])
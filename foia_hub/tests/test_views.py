@@ -1,8 +1,12 @@
+import json
+import re
 from datetime import date
 
 from django.core.urlresolvers import reverse
 from django.test import SimpleTestCase, TestCase
+from django.test.utils import override_settings
 from django.utils.unittest import skipUnless
+from mock import patch
 
 from foia_hub.models import Agency, FOIARequest, Office, Requester
 from foia_hub.models import ReadingRoomUrls
@@ -145,6 +149,15 @@ class AgenciesPageTests(TestCase):
         content = response.content.decode('utf-8')
         self.assertTrue('Department of Homeland Security' in content)
 
+    def test_agencies_search_shown_normalized(self):
+        """ The /agencies/ page shows the search its cached page is shared
+        under, not the visitor's own spelling of it. """
+
+        for query in ('COMMERCE', 'Commerce'):
+            response = self.client.get(
+                reverse('agencies'), {'query': query})
+            self.assertContains(response, '&ldquo;<em>commerce</em>&rdquo;')
+
     @skipUnless(custom_backend == 'postgresql_psycopg2',
                 'Only postgres has tsearch2')
     def test_agencies_search_list(self):
@@ -238,3 +251,140 @@ class ContactUpdaterPageTests(TestCase):
 
         response = self.client.get('/update-contacts/')
         self.assertEqual(response.status_code, 200)
+
+
+class PublicPageTests(TestCase):
+    fixtures = ['agencies_test.json', 'offices_test.json']
+
+    def test_no_cookies(self):
+        """ Public pages, including forms, set no cookies and don't vary on
+        them, whatever cookies come in. """
+
+        self.client.cookies['sessionid'] = 'abc'
+        for url in ('/', '/agencies/', '/contacts/department-of-commerce/',
+                    '/api/agency/', '/request/department-of-commerce/'):
+            response = self.client.get(url)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual({}, dict(response.cookies))
+            self.assertNotIn('Cookie', response.get('Vary', ''))
+
+    def test_csrf_token(self):
+        """ Forms get their token from an uncached view, and it works. """
+
+        response = self.client.get('/request/department-of-commerce/')
+        self.assertContains(
+            response, 'data-token-url="%s"' % reverse('csrf_token'))
+
+        client = self.client_class(enforce_csrf_checks=True)
+        response = client.post(reverse('noop'))
+        self.assertEqual(403, response.status_code)
+
+        response = client.get(reverse('csrf_token'))
+        self.assertIn('max-age=0', response['Cache-Control'])
+        self.assertIn('csrftoken', response.cookies)
+        token = json.loads(response.content.decode('utf-8'))['token']
+
+        response = client.post(
+            reverse('noop'), {'csrfmiddlewaretoken': token})
+        self.assertEqual(200, response.status_code)
+
+
+class RequestTimingTests(TestCase):
+    fixtures = ['agencies_test.json', 'offices_test.json']
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1)
+    def test_timed(self):
+        """ Sampled requests report their queries and timings in a header
+        and a log line. """
+
+        url = reverse('contact_landing', args=['department-of-commerce'])
+        with patch('foia_hub.middleware.timing_logger') as logger:
+            response = self.client.get(url)
+
+        header = response['Server-Timing']
+        self.assertTrue(header.startswith('db;dur='))
+        self.assertIn('render;dur=', header)
+        self.assertIn('total;dur=', header)
+
+        logged = json.loads(logger.info.call_args[0][0])
+        self.assertEqual(url, logged['path'])
+        self.assertEqual('contact_landing', logged['view'])
+        self.assertEqual(200, logged['status'])
+        self.assertTrue(logged['queries'] > 0)
+        self.assertIn('%s queries' % logged['queries'], header)
+        self.assertTrue(logged['render_ms'] > 0)
+
+    def test_not_sampled(self):
+        """ Requests outside of the sample are left alone. """
+
+        url = reverse('contact_landing', args=['department-of-commerce'])
+        with patch('foia_hub.middleware.timing_logger') as logger:
+            response = self.client.get(url)
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertFalse(logger.info.called)
+
+
+class SearchQueryLogTests(TestCase):
+    fixtures = ['agencies_test.json']
+
+    def test_logged(self):
+        """ First pages of searches are logged with their endpoint. """
+
+        with patch('foia_hub.middleware.search_logger') as logger:
+            self.client.get('/api/agency/?query=Commerce')
+            self.client.get('/agencies?query=commerce')
+            self.client.get('/api/agency/?query=commerce&cursor=abc')
+            self.client.get('/api/agency/')
+
+        logged = [json.loads(c[0][0]) for c in logger.info.call_args_list]
+        self.assertEqual([
+            {'endpoint': 'agency', 'query': 'Commerce'},
+            {'endpoint': 'agencies', 'query': 'commerce'},
+        ], logged)
+
+
+class TypeaheadTests(TestCase):
+    fixtures = ['agencies_test.json']
+
+    def typeahead_url(self):
+        """ The feed URL that pages give the search box. """
+
+        content = self.client.get(reverse('home')).content.decode('utf-8')
+        return re.search(r"typeaheadUrl = '([^']+)'", content).group(1)
+
+    def test_typeahead(self):
+        """ The current version of the feed lists each agency's name,
+        abbreviation and slug, and can be cached forever. """
+
+        response = self.client.get(self.typeahead_url())
+        self.assertEqual(200, response.status_code)
+        self.assertIn('immutable', response['Cache-Control'])
+        feed = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(['name', 'abbreviation', 'slug'], feed['fields'])
+        self.assertEqual(
+            ['Department of Commerce', 'DOC', 'department-of-commerce'],
+            feed['agencies'][0])
+
+    def test_versions(self):
+        """ The version changes with the data, and old versions are
+        redirected to the current one. """
+
+        old_url = self.typeahead_url()
+        Agency.objects.filter(slug='department-of-commerce').update(
+            abbreviation='DoC')
+        url = self.typeahead_url()
+        self.assertNotEqual(old_url, url)
+
+        response = self.client.get(old_url)
+        self.assertEqual(302, response.status_code)
+        self.assertTrue(response['Location'].endswith(url))
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+
+class WSGITests(TestCase):
+
+    def test_application_loads(self):
+        """ The WSGI module that gunicorn loads can be imported. """
+
+        from foia_hub.wsgi import application
+        self.assertTrue(callable(application))
@@ -4,9 +4,10 @@ from django.views.generic import TemplateView
 
 from foia_hub.views import (
     contact_landing, agencies,
-    request_form, request_noop)
+    request_form, request_noop, typeahead, csrf_token)
 
-from foia_hub.api import AgencyResource, OfficeResource, FOIARequestResource
+from foia_hub.api import (
+    AgencyResource, OfficeResource, SearchResource, FOIARequestResource)
 
 import contact_updater.urls as contact_updater_urls
 
@@ -26,6 +27,7 @@ urlpatterns = patterns(
         name='contact_landing'),
     url(r'^request/noop/$', request_noop, name='noop'),
     url(r'^request/(?P<slug>[-\w]+)/$', request_form, name='form'),
+    url(r'^csrf-token/$', csrf_token, name='csrf_token'),
     url(r'^robots\.txt$',
         TemplateView.as_view(
             template_name='robots.txt', content_type='text/plain')),
@@ -37,6 +39,9 @@ urlpatterns += patterns(
     '',
     url(r'^api/agency/', include(AgencyResource.urls())),
     url(r'^api/office/', include(OfficeResource.urls())),
+    url(r'^api/search/', include(SearchResource.urls())),
+    url(r'^api/typeahead/(?P<version>\w+)\.json$', typeahead,
+        name='typeahead'),
 )
 
 if settings.SHOW_WEBFORM:
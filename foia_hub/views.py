@@ -1,7 +1,20 @@
 from django.conf import settings
-from django.shortcuts import render
+from django import shortcuts
+from django.http import HttpResponse, JsonResponse
+from django.middleware.csrf import get_token
+from django.utils.cache import add_never_cache_headers
+from django.views.decorators.cache import never_cache
 
-from foia_hub.api import AgencyResource, OfficeResource
+from foia_hub.api import (
+    AgencyResource, OfficeResource, search_text, typeahead_feed)
+from foia_hub.middleware import timed
+
+
+def render(request, *args, **kwargs):
+    """ Renders a template, timing it for RequestTimingMiddleware. """
+
+    with timed(request, 'render'):
+        return shortcuts.render(request, *args, **kwargs)
 
 
 ###
@@ -13,13 +26,13 @@ def agencies(request):
     """Full agency listing."""
     query = request.GET.get("query")
 
-    agencies = AgencyResource().list(query)
+    agencies = AgencyResource().all_agencies(query)
     return render(
         request,
         'contacts/index.html',
         {
             'agencies': agencies,
-            'query': query
+            'query': search_text(query)
         })
 
 
@@ -58,12 +71,28 @@ def contact_landing(request, slug):
 
 def get_agency_list():
     resource = AgencyResource()
-    agencies = resource.list()
+    agencies = resource.all_agencies()
     agency_list = [
         {'name': agency.name, 'slug': agency.slug} for agency in agencies]
     return agency_list
 
 
+def typeahead(request, version):
+    """ The agencies for the search box's typeahead. The URL is versioned by
+    the content, so each version can be cached forever; an old version is
+    redirected to the current one. """
+
+    feed, current = typeahead_feed()
+    if version != current:
+        response = shortcuts.redirect('typeahead', current)
+        add_never_cache_headers(response)
+        return response
+
+    response = HttpResponse(feed, content_type='application/json')
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
 ###
 # Contacting agencies/offices that lack a webform of their own.
 ###
@@ -88,3 +117,11 @@ def request_noop(request):
     that in the slim chance the form gets turned on in an environment it
     shouldn't be on in. """
     return render(request, 'request/noop.html', {})
+
+
+@never_cache
+def csrf_token(request):
+    """ A CSRF token for the forms on cached pages, which can't include one.
+    This sets the CSRF cookie, and is never cached. """
+
+    return JsonResponse({'token': get_token(request)})
@@ -19,3 +19,14 @@ if os.getenv("NEW_RELIC_LICENSE_KEY"):
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "foia_hub.settings")
 application = Cling(get_wsgi_application())
+
+# Build the search index and snapshot before the first request needs them.
+# With gunicorn's --preload, this happens once, before workers are forked, so
+# the connection used is closed rather than shared with them.
+from django.db import connections  # noqa
+from foia_hub.search import warm_index  # noqa
+from foia_hub.snapshot import warm_snapshot  # noqa
+warm_index()
+warm_snapshot()
+for conn in connections.all():
+    conn.close()